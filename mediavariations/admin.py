@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+from django.conf.urls import patterns, url
+from django.contrib import admin
+from django.shortcuts import render_to_response
+from django.template import RequestContext
+from django.utils.translation import ugettext_lazy as _
+
+from .models import Batch, Variation
+from .reports import get_slo_report
+
+
+class BatchAdmin(admin.ModelAdmin):
+    """
+    progress view for the batches started by the admin actions
+    """
+
+    list_display = ('spec', 'total', 'completed', 'failed', 'progress', 'throughput', 'created', 'processed')
+    readonly_fields = list_display
+
+    def has_add_permission(self, request):
+        return False
+
+    def progress(self, obj):
+        return '%d%%' % (obj.get_progress() * 100)
+    progress.short_description = _('progress')
+
+    def throughput(self, obj):
+        return _('%.2f files/s') % obj.get_throughput()
+    throughput.short_description = _('throughput')
+
+admin.site.register(Batch, BatchAdmin)
+
+
+class VariationAdmin(admin.ModelAdmin):
+    """
+    the variations and the report of their processing latency at slo/
+    """
+
+    list_display = ('spec', 'content_type', 'object_id', 'progress', 'queued', 'started', 'processed', 'failure')
+    list_filter = ('spec', 'content_type')
+    readonly_fields = ('queued', 'started', 'processed', 'failure')
+
+    def get_urls(self):
+        return patterns('',
+            url(r'^slo/$', self.admin_site.admin_view(self.slo_view), name='mediavariations_variation_slo'),
+        ) + super(VariationAdmin, self).get_urls()
+
+    def slo_view(self, request):
+        try:
+            hours = float(request.GET.get('hours', 24))
+        except ValueError:
+            hours = 24
+
+        report = get_slo_report(datetime.now() - timedelta(hours=hours))
+
+        return render_to_response('admin/mediavariations/variation/slo.html', {
+            'title' : _('Processing latency'),
+            'hours' : hours,
+            'since' : report['since'],
+            'groups' : ((_('Spec'), report['specs']), (_('Backend'), report['backends'])),
+        }, context_instance=RequestContext(request))
+
+admin.site.register(Variation, VariationAdmin)
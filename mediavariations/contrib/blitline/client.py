@@ -0,0 +1,195 @@
+import errno
+import httplib
+import random
+import socket
+import threading
+import urllib
+from Queue import Queue, Empty, Full
+from time import sleep, time
+from urlparse import urlparse
+
+from django.utils import simplejson
+
+from ... import settings
+from ...specs import SpecUnavailable
+
+
+class BlitlineError(SpecUnavailable):
+    """
+    blitline could not be reached or answered with an error
+    """
+
+
+class CircuitOpen(BlitlineError):
+    """
+    too many recent failures, blitline is not called until the breaker resets
+    """
+
+
+class CircuitBreaker(object):
+    """
+    opens after ``threshold`` consecutive failed attempts and fails fast while open.
+    after ``reset_timeout`` seconds one trial call is let through (half-open),
+    which closes the breaker again on success.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened is None:
+                return True
+            if time() - self.opened >= self.reset_timeout:
+                # half-open: let this call through, but keep the others out
+                self.opened = time()
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened = time()
+
+
+def is_stale(e):
+    """
+    whether a request on a reused keep-alive connection failed, because the server
+    had closed the connection while it was idle. no byte of the response arrived.
+    """
+
+    if isinstance(e, httplib.BadStatusLine):
+        return e.line in ('', "''") or e.line.startswith('No status line')
+    return isinstance(e, socket.error) and e.errno in (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+
+
+class Client(object):
+    """
+    blitline api client with a pool of keep-alive connections, separate connect
+    and read timeouts, bounded retries with jittered backoff and a circuit
+    breaker. it is shared by all threads, see get_client.
+    """
+
+    def __init__(self, url=None, connect_timeout=None, read_timeout=None, retries=None,
+            backoff=0.1, pool_size=None, breaker=None):
+        parsed = urlparse(url or settings.BLITLINE_API_URL)
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.secure = parsed.scheme == 'https'
+        self.connect_timeout = connect_timeout or settings.BLITLINE_CONNECT_TIMEOUT
+        self.read_timeout = read_timeout or settings.BLITLINE_READ_TIMEOUT
+        self.retries = settings.BLITLINE_RETRIES if retries is None else retries
+        self.backoff = backoff
+        self.pool = Queue(pool_size or settings.BLITLINE_POOL_SIZE)
+        self.breaker = breaker or CircuitBreaker(settings.BLITLINE_BREAKER_THRESHOLD,
+            settings.BLITLINE_BREAKER_RESET)
+
+    def get_connection(self, fresh=False):
+        """
+        a pooled or a new connection and whether it is reused
+        """
+
+        if not fresh:
+            try:
+                return self.pool.get_nowait(), True
+            except Empty:
+                pass
+
+        connection_class = httplib.HTTPSConnection if self.secure else httplib.HTTPConnection
+        connection = connection_class(self.host, self.port, timeout=self.connect_timeout)
+        connection.connect()
+        connection.sock.settimeout(self.read_timeout)
+        return connection, False
+
+    def release_connection(self, connection):
+        try:
+            self.pool.put_nowait(connection)
+        except Full:
+            connection.close()
+
+    def request(self, method, path, body=None, idempotent=True):
+        """
+        send a request and return the parsed json response. a request, which may
+        have reached blitline, is only retried if it is idempotent.
+        """
+
+        if not self.breaker.allow():
+            raise CircuitOpen('Blitline is unavailable, the circuit breaker is open')
+
+        headers = {'Connection' : 'keep-alive'}
+        if body is not None:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        for attempt in range(self.retries + 1):
+            sent = False
+            try:
+                connection, reused = self.get_connection()
+                try:
+                    try:
+                        connection.request(method, path, body, headers)
+                        sent = True
+                        response = connection.getresponse()
+                    except (socket.error, httplib.HTTPException), e:
+                        if not (reused and is_stale(e)):
+                            raise
+
+                        # blitline didn't get the request, so it isn't a failure and
+                        # can be sent again, even if it isn't idempotent
+                        connection.close()
+                        connection, reused = self.get_connection(fresh=True)
+                        sent = False
+                        connection.request(method, path, body, headers)
+                        sent = True
+                        response = connection.getresponse()
+                    raw = response.read()
+                except:
+                    connection.close()
+                    raise
+
+                if response.will_close:
+                    connection.close()
+                else:
+                    self.release_connection(connection)
+
+                if response.status >= 500:
+                    raise BlitlineError('Blitline answered with status %s' % response.status)
+
+                parsed = simplejson.loads(raw)
+            except (socket.error, httplib.HTTPException, BlitlineError, ValueError), e:
+                self.breaker.failure()
+
+                if attempt == self.retries or (sent and not idempotent) or not self.breaker.allow():
+                    raise BlitlineError('Blitline request %s %s failed: %s' % (method, path, e))
+
+                # exponential backoff with full jitter
+                sleep(random.uniform(0, self.backoff * 2 ** attempt))
+            else:
+                self.breaker.success()
+                return parsed
+
+    def submit_job(self, job):
+        body = urllib.urlencode({'json' : simplejson.dumps(job)})
+        return self.request('POST', '/job', body, idempotent=False)
+
+    def poll(self, job_id):
+        return self.request('GET', '/poll?%s' % urllib.urlencode({'job_id' : job_id}))
+
+
+_client = None
+
+def get_client():
+    global _client
+
+    if _client is None:
+        _client = Client()
+    return _client
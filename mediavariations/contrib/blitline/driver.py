@@ -0,0 +1,133 @@
+from datetime import datetime
+from multiprocessing.pool import ThreadPool
+
+from django.db import transaction
+
+from ... import settings
+from ...executor import logger
+from ...models import Variation
+from ...registry import registry
+from ...specs import SpecUnavailable
+
+
+def get_blitline_specs():
+    """
+    the dotted paths of all specs in use, which are processed by blitline
+    """
+
+    specs = Variation.objects.values_list('spec', flat=True).distinct()
+    return [spec for spec in specs if registry.get_class(spec).get_backend() == 'blitline']
+
+
+class Driver(object):
+    """
+    submits and polls many blitline jobs at once. the http requests run in a
+    pool of ``concurrency`` threads, which share the keep-alive connections of
+    the blitline client (set MEDIAVARIATIONS_BLITLINE_POOL_SIZE accordingly).
+    the database is only used from the calling thread and the results are
+    written back in batches.
+    """
+
+    def __init__(self, concurrency=100):
+        self.pool = ThreadPool(concurrency)
+
+    def get_pending(self, limit):
+        """
+        blitline variations, which were not submitted yet. the ones, which failed
+        for good, are left out
+        """
+
+        return Variation.objects.filter(spec__in=get_blitline_specs(), file='',
+            progress__isnull=True, failure='').order_by('pk')[:limit]
+
+    def get_running(self, limit):
+        """
+        submitted blitline variations, which are not finished yet
+        """
+
+        return Variation.objects.filter(spec__in=get_blitline_specs(), progress__isnull=False,
+            processed__isnull=True).order_by('pk')[:limit]
+
+    def submit(self, variations):
+        """
+        submit the jobs of the variations, which are not leased by another worker.
+        variations of byte-identical originals reuse the job of the first one, see
+        Variation.reuse_output. returns the number of submitted jobs.
+        """
+
+        variations = Variation.objects.acquire_leases(variations).prefetch_related('content_object')
+
+        # build the spec instances here, they need the database
+        specs = [variation.get_spec_instance() for variation in variations]
+
+        def get_checksum(spec):
+            try:
+                return spec, spec.variation.get_checksum()
+            except Exception:
+                logger.exception('Reading the original of variation %s failed' % spec.variation.pk)
+                return spec, None
+
+        def submit_job(spec):
+            try:
+                return spec.variation, spec.run()
+            except SpecUnavailable, e:
+                # retried with the next batch
+                logger.warning('Blitline is unavailable for variation %s: %s' % (spec.variation.pk, e))
+                return spec.variation, None
+            except Exception, e:
+                logger.exception('Submitting the blitline job of variation %s failed' % spec.variation.pk)
+                spec.variation.failure = '%s: %s' % (e.__class__.__name__, e)
+                return spec.variation, None
+
+        submitted = 0
+        now = datetime.now()
+
+        with transaction.commit_on_success():
+            checksums = {}
+            if settings.DEDUPLICATE:
+                remaining = [spec for spec in specs if not spec.deduplicate]
+                specs = [spec for spec in specs if spec.deduplicate]
+                for spec, checksum in self.pool.imap_unordered(get_checksum, specs):
+                    if checksum and spec.variation.reuse_output(checksum):
+                        self.save_submitted(spec.variation, now)
+                        continue
+                    if checksum:
+                        checksums[spec.variation.pk] = checksum
+                    remaining.append(spec)
+                specs = remaining
+
+            for variation, name in self.pool.imap_unordered(submit_job, specs):
+                if name:
+                    variation.file = name
+                    if variation.pk in checksums:
+                        variation.add_output(checksums[variation.pk])
+                    self.save_submitted(variation, now)
+                    submitted += 1
+                else:
+                    Variation.objects.filter(pk=variation.pk).update(lease_expires=None, started=now,
+                        failure=variation.failure)
+
+        return submitted
+
+    def save_submitted(self, variation, now):
+        Variation.objects.filter(pk=variation.pk).update(file=variation.file.name, progress=0.0,
+            metadata=variation.metadata, output=variation.output, modified=now, started=now,
+            failure='', lease_expires=None)
+
+    def poll(self, variations):
+        """
+        poll the progress of the variations. only the changes are written, see
+        VariationManager.poll_progress. returns the number of finished jobs.
+        """
+
+        # build the spec instances here, they need the database
+        variations = list(variations.prefetch_related('content_object'))
+        for variation in variations:
+            variation.get_spec_instance()
+
+        changed = Variation.objects.poll_progress(variations, self.pool.imap_unordered)
+        return len([progress for progress in changed.values() if progress >= 1.0])
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
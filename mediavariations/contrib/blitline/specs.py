@@ -1,10 +1,9 @@
 import os
-import urllib
 
 from django.conf import settings
-from django.utils import simplejson
 
 from ...specs import Base
+from .client import get_client
 
 
 class Generic(Base):
@@ -15,15 +14,23 @@ class Generic(Base):
         ],
     }
 
+    # blitline fetches the original itself
+    memory_factor = 0
+
+    asynchronous = True
+
     def process(self):
         options = self.get_options()
 
+        # blitline uploads to s3 itself, which is the remote tier of a TieredStorage
+        storage = getattr(self.storage, 'remote', self.storage)
+
         # extend the options
         options['functions'][0]['save'] = {
             'image_identifier' : self.variation_filename,
             's3_destination' : {
                 'bucket' : settings.AWS_STORAGE_BUCKET_NAME,
-                'key' : os.path.join(self.storage.location, self.variation_path)
+                'key' : os.path.join(storage.location, self.variation_path)
             }
         }
 
@@ -33,21 +40,20 @@ class Generic(Base):
             'src' : self.original.url,
         })
 
-        job_json = simplejson.dumps(options)
-
-        params = urllib.urlencode({'json' : job_json})
-        raw = urllib.urlopen('http://api.blitline.com/job', params).read()
-
-        parsed = simplejson.loads(raw)
+        parsed = get_client().submit_job(options)
 
         # if the result is not as expected, this fails.
         self.blitline_job_response = parsed
         self.blitlite_job_id = parsed['results']['job_id']
+
+        # keep the job id, so the progress can be polled from another process
+        self.set_metadata(blitline_job_id=self.blitlite_job_id)
+
         return os.path.join(self.variation_directory, parsed['results']['images'][0]['image_identifier'])
 
     def get_progress(self):
-        raw = urllib.urlopen('http://api.blitline.com/poll?job_id=%s' % self.blitlite_job_id).read()
-        parsed = simplejson.loads(raw)
+        job_id = getattr(self, 'blitlite_job_id', None) or self.variation.get_metadata()['blitline_job_id']
+        parsed = get_client().poll(job_id)
 
         if parsed.get('is_complete', False):
             return 1.0
@@ -1,19 +1,54 @@
 from django.contrib.contenttypes import generic
+from django.core.urlresolvers import reverse
+from django.db import transaction
+from django.http import HttpResponseRedirect
 from django.utils.translation import ugettext_lazy as _
 
 from ... import settings
-from ...models import Variation
-from ...utils import get_object
+from ...executor import PRIORITY_BULK, get_executor, logger
+from ...models import Batch, Variation
+from ...registry import registry
 
 
-def _admin_action_factory(specpath):
-    spec_class = get_object(specpath)
+def apply_spec(batch_id, model, pks):
+    """
+    apply the spec of the batch on the mediafiles with the given pks. runs in
+    the background executor.
+    """
 
-    def admin_action(modeladmin, request, queryset):
-        for mf in queryset:
+    batch = Batch.objects.get(pk=batch_id)
+    spec_class = registry.get_class(batch.spec)
+
+    for mf in model._default_manager.filter(pk__in=pks):
+        try:
             spec = spec_class(variation=mf, original=mf.file)
-            mf.file = spec.process()
+            mf.file = spec.run()
             mf.save()
+        except Exception:
+            logger.exception('Applying %s on %s failed' % (batch.spec, mf))
+            batch.add_result(success=False)
+        else:
+            batch.add_result()
+
+
+def _admin_action_factory(specpath):
+    spec_class = registry.get_class(specpath)
+
+    def admin_action(modeladmin, request, queryset):
+        pks = list(queryset.values_list('pk', flat=True))
+
+        # the workers load the batch with their own connections, commit it before
+        # submitting, also within the transaction of TransactionMiddleware
+        with transaction.commit_on_success():
+            batch = Batch.objects.create(spec=specpath, total=len(pks))
+
+        executor = get_executor()
+        size = settings.FEINCMS_ADMINACTION_BATCH_SIZE
+        for start in range(0, len(pks), size):
+            executor.submit(apply_spec, batch.pk, queryset.model, pks[start:start + size],
+                priority=PRIORITY_BULK, backend=spec_class.get_backend())
+
+        return HttpResponseRedirect(reverse('admin:mediavariations_batch_change', args=(batch.pk,)))
 
     admin_action.short_description = _('Apply variation "%s" on this mediafile' % spec_class.get_shortname())
 
@@ -0,0 +1,168 @@
+import cStringIO
+import os
+
+from django.core.files.base import ContentFile
+
+try:
+    from PIL import Image, ImageChops, ImageStat
+except ImportError:
+    import Image, ImageChops, ImageStat
+
+from ...memory import decoded
+from ...specs import Base
+
+
+# PIL formats for the extensions of the variations
+FORMATS = {
+    '.jpg' : 'JPEG',
+    '.jpeg' : 'JPEG',
+    '.png' : 'PNG',
+    '.gif' : 'GIF',
+    '.tif' : 'TIFF',
+    '.tiff' : 'TIFF',
+    '.bmp' : 'BMP',
+    '.webp' : 'WEBP',
+    '.avif' : 'AVIF',
+}
+
+# formats, whose quality setting trades size for fidelity
+LOSSY = ('JPEG', 'WEBP', 'AVIF')
+
+
+def can_save(format):
+    Image.init()
+    return format in Image.SAVE
+
+
+def bisect(low, high, predicate):
+    """
+    the lowest value in [low, high], for which the monotonic predicate is true.
+    high + 1 if there is none.
+    """
+    while low <= high:
+        middle = (low + high) // 2
+        if predicate(middle):
+            high = middle - 1
+        else:
+            low = middle + 1
+    return low
+
+
+class Thumbnail(Base):
+    """
+    scales the image down to fit into ``size``. besides the variation in the
+    format of the original, siblings in the modern ``formats`` (webp, avif) are
+    saved, if PIL supports them. their names are kept in the metadata of the
+    variation, see Variation.get_format_name.
+
+    instead of the fixed ``quality``, lossy formats can be encoded with the
+    highest quality, which fits into ``target_size`` bytes, and/or the lowest
+    quality, whose rms error stays below ``max_error`` (0-255). the quality is
+    searched between ``min_quality`` and ``quality``. the chosen qualities and
+    sizes are kept in the metadata.
+    """
+
+    defaults = {
+        'size' : [200, 200],
+        'quality' : 85,
+        'formats' : ['webp', 'avif'],
+        'target_size' : None,
+        'max_error' : None,
+        'min_quality' : 30,
+    }
+
+    # the decoded pixels are much bigger than the compressed original
+    memory_factor = 10
+
+    def get_image(self):
+        """
+        the decoded original. it is kept in the decoded cache for the next specs
+        and copied, transform may change it in place.
+        """
+        key = self.get_original_key()
+        image = decoded.get(key)
+        if image is None:
+            with self.open_original() as original:
+                image = Image.open(original)
+                image.load()
+            decoded.set(key, image, image.size[0] * image.size[1] * len(image.getbands()))
+        return image.copy()
+
+    def transform(self, image, options):
+        image.thumbnail(options['size'], Image.ANTIALIAS)
+        return image
+
+    def encode(self, image, format, quality):
+        if format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        memfile = cStringIO.StringIO()
+        image.save(memfile, format, quality=quality)
+        content = memfile.getvalue()
+        memfile.close()
+        return content
+
+    def get_error(self, reference, content):
+        """
+        rms error of an encoded image against the reference, averaged over the bands
+        """
+        trial = Image.open(cStringIO.StringIO(content)).convert('RGB')
+        rms = ImageStat.Stat(ImageChops.difference(reference, trial)).rms
+        return sum(rms) / len(rms)
+
+    def search_quality(self, image, format, options):
+        """
+        binary search of the quality for the targets of the options. the trials
+        encode the same, already transformed image. returns (content, quality).
+        """
+        encoded = {}
+
+        def encode(quality):
+            if quality not in encoded:
+                encoded[quality] = self.encode(image, format, quality)
+            return encoded[quality]
+
+        low, high = options['min_quality'], options['quality']
+
+        if options['target_size']:
+            too_big = bisect(low, high, lambda quality: len(encode(quality)) > options['target_size'])
+            high = max(too_big - 1, low)
+
+        quality = high
+        if options['max_error'] is not None:
+            reference = image.convert('RGB')
+            quality = min(bisect(low, high,
+                lambda quality: self.get_error(reference, encode(quality)) <= options['max_error']), high)
+
+        return encode(quality), quality
+
+    def save_image(self, image, path, options):
+        """
+        encode and save the image. returns its name and the quality and size of
+        the encoding.
+        """
+        format = FORMATS[os.path.splitext(path)[1].lower()]
+
+        if format in LOSSY and (options['target_size'] or options['max_error'] is not None):
+            content, quality = self.search_quality(image, format, options)
+        else:
+            content, quality = self.encode(image, format, options['quality']), options['quality']
+
+        name = self.storage.save(path, ContentFile(content))
+        return name, {'quality' : quality, 'size' : len(content)}
+
+    def process(self):
+        options = self.get_options()
+        image = self.transform(self.get_image(), options)
+
+        name, encoding = self.save_image(image, self.variation_path, options)
+
+        siblings = {}
+        encodings = {}
+        for format in options['formats']:
+            if can_save(format.upper()):
+                path = '%s.%s' % (os.path.splitext(self.variation_path)[0], format)
+                siblings[format], encodings[format] = self.save_image(image, path, options)
+        self.set_metadata(formats=siblings, encodings=encodings, **encoding)
+
+        return name
@@ -1,11 +1,9 @@
-import cStringIO
-
-from django.core.files import File
-from django.core.files.base import ContentFile
+from datetime import datetime
 
 from pyPdf import PdfFileWriter, PdfFileReader
 
 from ...specs import Base
+from ...utils import dump_options
 
 
 class PageRange(Base):
@@ -14,24 +12,102 @@ class PageRange(Base):
         'stop' : 1
     }
 
+    # the parsed document and the written pages
+    memory_factor = 2
+
     def process(self):
         options = self.get_options()
-        reader = PdfFileReader(self.original)
         output = PdfFileWriter()
+        spooled = self.spool()
+
+        try:
+            with self.open_original() as original:
+                reader = PdfFileReader(original)
+
+                for n in range(options['start'], options['stop']):
+                    try:
+                        output.addPage(reader.pages[n])
+                    except IndexError:
+                        pass
+
+                output.write(spooled)
+
+            return self.save_spooled(self.variation_path, spooled)
+        finally:
+            spooled.close()
+
+
+class SplitPages(PageRange):
+    """
+    parses the pdf once and writes every page, or the given ``ranges`` of
+    [start, stop], as PageRange variation of the same original. the variation
+    of this spec holds no file, but the page count, the document info and the
+    pks of the page variations in its metadata.
+    """
+
+    defaults = {
+        'ranges' : None,
+    }
+
+    # the metadata holds the page variations of this object
+    deduplicate = False
+
+    def get_page_variation(self, start, stop):
+        """
+        the PageRange variation for a range, as get_for_object would create it
+        """
+        # the registry imports the specs while the models are loaded
+        from ...models import Variation
+
+        lookup = dict(
+            content_type = self.variation.content_type,
+            object_id = self.variation.object_id,
+            field = self.variation.field,
+            spec = '%s.%s' % (PageRange.__module__, PageRange.__name__),
+            options = dump_options({'start' : start, 'stop' : stop})
+        )
+
+        try:
+            return Variation.objects.filter(**lookup).order_by('pk')[0]
+        except IndexError:
+            # the page is written from the parsed document, not by PageRange
+            variation = Variation(**lookup)
+            variation.save(process=False)
+            return variation
+
+    def process(self):
+        options = self.get_options()
+        page_variations = {}
 
-        for n in range(options['start'], options['stop']):
-            try:
-                output.addPage(reader.pages[n])
-            except IndexError:
-                pass
+        with self.open_original() as original:
+            reader = PdfFileReader(original)
+            pages = reader.getNumPages()
 
-        memfile = cStringIO.StringIO()
-        output.write(memfile)
-        content_file = ContentFile(memfile.getvalue())
-        memfile.close()
+            info = {}
+            for key, value in (reader.getDocumentInfo() or {}).items():
+                info[key.lstrip('/')] = unicode(value)
 
-        return self.storage.save(self.variation_path, content_file)
+            for start, stop in options['ranges'] or [(n, n + 1) for n in range(pages)]:
+                variation = self.get_page_variation(start, stop)
+                page_variations['%s-%s' % (start, stop)] = variation.pk
+                if variation.file:
+                    continue
 
+                output = PdfFileWriter()
+                for n in range(start, min(stop, pages)):
+                    output.addPage(reader.getPage(n))
 
+                spooled = self.spool()
+                try:
+                    output.write(spooled)
+                    spec = PageRange(variation=variation, original=self.original, storage=self.storage)
+                    variation.file = spec.save_spooled(spec.variation_path, spooled)
+                finally:
+                    spooled.close()
 
+                variation.progress = 1.0
+                variation.processed = datetime.now()
+                variation.save(process=False)
 
+        self.set_metadata(pages=pages, info=info, variations=page_variations)
+        return ''
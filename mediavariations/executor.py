@@ -0,0 +1,187 @@
+import heapq
+import itertools
+import logging
+import threading
+from collections import defaultdict
+from time import time
+
+from django.db import connection
+
+from . import settings
+from .utils import get_object
+
+
+logger = logging.getLogger('mediavariations')
+
+# lower values are served first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 5
+PRIORITY_BULK = 10
+
+
+class SyncExecutor(object):
+    """
+    runs the submitted functions right away. useful for tests and development
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        kwargs.pop('priority', None)
+        kwargs.pop('backend', None)
+        fn(*args, **kwargs)
+
+    def join(self):
+        pass
+
+
+class TokenBucket(object):
+    """
+    allows ``rate`` jobs per second on average and bursts of up to ``burst`` jobs
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst or max(self.rate, 1)
+        self.tokens = self.burst
+        self.stamp = time()
+
+    def get_delay(self):
+        """
+        seconds until the next token is available, 0 if there is one now
+        """
+
+        now = time()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+
+class Scheduler(object):
+    """
+    runs the submitted functions in a pool of daemon threads of the current
+    process. the threads are started on the first submit.
+
+    every job has a priority and a backend (see ``specs.Base.get_backend``).
+    a free worker takes the job with the highest priority among the backends,
+    which are below their concurrency limit and have a token in their bucket.
+    the limits are configured per backend in MEDIAVARIATIONS_BACKEND_LIMITS:
+
+        {'blitline' : {'concurrency' : 20, 'rate' : 10, 'burst' : 20}}
+    """
+
+    def __init__(self, workers=None, limits=None):
+        self.workers = workers or settings.EXECUTOR_WORKERS
+        self.limits = settings.BACKEND_LIMITS if limits is None else limits
+        self.queues = defaultdict(list) # backend -> heap of jobs
+        self.running = defaultdict(int)
+        self.buckets = {}
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.threads = []
+
+    def start(self):
+        with self.condition:
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self.work, name='mediavariations-%s' % len(self.threads))
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, fn, *args, **kwargs):
+        priority = kwargs.pop('priority', PRIORITY_DEFAULT)
+        backend = kwargs.pop('backend', None) or 'local'
+
+        with self.condition:
+            # the counter keeps the jobs of the same priority in fifo order
+            heapq.heappush(self.queues[backend], (priority, next(self.counter), fn, args, kwargs))
+            self.condition.notify()
+
+        self.start()
+
+    def get_bucket(self, backend):
+        if backend not in self.buckets:
+            limits = self.limits.get(backend, {})
+            self.buckets[backend] = limits.get('rate') and TokenBucket(limits['rate'], limits.get('burst'))
+        return self.buckets[backend]
+
+    def pop(self):
+        """
+        return the next runnable job, its backend and, if there is no runnable job,
+        the seconds until a rate limit allows the next one (None if only a
+        finishing job can make room). has to be called with the condition held.
+        """
+
+        best, wait = None, None
+
+        for backend, jobs in self.queues.items():
+            if not jobs:
+                continue
+
+            concurrency = self.limits.get(backend, {}).get('concurrency')
+            if concurrency and self.running[backend] >= concurrency:
+                continue
+
+            bucket = self.get_bucket(backend)
+            delay = bucket and bucket.get_delay()
+            if delay:
+                wait = delay if wait is None else min(wait, delay)
+                continue
+
+            if best is None or jobs[0] < self.queues[best][0]:
+                best = backend
+
+        if best is None:
+            return None, None, wait
+
+        if self.get_bucket(best):
+            self.get_bucket(best).consume()
+        self.running[best] += 1
+        return heapq.heappop(self.queues[best]), best, None
+
+    def work(self):
+        while True:
+            with self.condition:
+                job, backend, wait = self.pop()
+                while job is None:
+                    self.condition.wait(wait)
+                    job, backend, wait = self.pop()
+
+            priority, counter, fn, args, kwargs = job
+            try:
+                fn(*args, **kwargs)
+            except Exception:
+                logger.exception('Background job %r failed' % fn)
+            finally:
+                # every thread has its own connection, don't leave it open
+                connection.close()
+
+                with self.condition:
+                    self.running[backend] -= 1
+                    self.condition.notify_all()
+
+    def join(self):
+        """
+        block until all submitted jobs are done
+        """
+
+        with self.condition:
+            while any(self.queues.values()) or any(self.running.values()):
+                self.condition.wait(1)
+
+
+_executor = None
+
+def get_executor():
+    """
+    return the executor configured with MEDIAVARIATIONS_EXECUTOR
+    """
+    global _executor
+
+    if _executor is None:
+        _executor = get_object(settings.EXECUTOR)()
+    return _executor
@@ -0,0 +1,87 @@
+from django.db import transaction
+
+from .executor import logger
+from .models import Output, Variation
+from .storage import exists_many
+from .utils import get_sharded_name
+
+
+def move(storage, old, new):
+    """
+    move a file within a storage. it is safe to repeat a move, which was
+    interrupted. returns False if the file is missing or the storage saved it
+    under another name, because the new one was taken meanwhile.
+    """
+
+    if not storage.exists(old):
+        return storage.exists(new)
+
+    if storage.exists(new):
+        if storage.size(new) == storage.size(old):
+            # copied, but not deleted
+            storage.delete(old)
+            return True
+        storage.delete(new)
+
+    content = storage.open(old)
+    try:
+        saved = storage.save(new, content)
+    finally:
+        content.close()
+
+    if saved != new:
+        storage.delete(saved)
+        return False
+
+    storage.delete(old)
+    return True
+
+
+def reshard(variations, pool, depth):
+    """
+    move the files of the variations and their siblings into the sharded layout
+    and rewrite the names in one transaction. the files are moved by the
+    threads of the pool. returns the number of rewritten variations.
+    """
+
+    storage = Variation._meta.get_field('file').storage
+
+    moves = {}
+    for variation in variations:
+        names = [variation.file.name] + variation.get_metadata().get('formats', {}).values()
+        for name in names:
+            if get_sharded_name(name, depth) != name:
+                moves[name] = get_sharded_name(name, depth)
+
+    # files moved by an interrupted run are found without touching them
+    existing = exists_many(storage, moves.keys() + moves.values())
+
+    moved = {}
+    for name, new in moves.items():
+        if not existing[name]:
+            moved[name] = existing[new]
+
+    def move_file(name):
+        try:
+            return name, move(storage, name, moves[name])
+        except Exception:
+            logger.exception('Moving %s failed' % name)
+            return name, False
+
+    moved.update(pool.imap_unordered(move_file, [name for name in moves if name not in moved]))
+
+    rewritten = 0
+    with transaction.commit_on_success():
+        for variation in variations:
+            name = variation.file.name
+            formats = variation.get_metadata().get('formats', {})
+
+            if not all(moved.get(sibling, False) for sibling in [name] + formats.values()):
+                continue
+
+            variation.set_metadata(formats=dict((format, moves[sibling]) for format, sibling in formats.items()))
+            Variation.objects.filter(pk=variation.pk).update(file=moves[name], metadata=variation.metadata)
+            Output.objects.filter(name=name).update(name=moves[name], metadata=variation.metadata)
+            rewritten += 1
+
+    return rewritten
@@ -0,0 +1,50 @@
+from optparse import make_option
+from time import sleep
+
+from django.core.management.base import BaseCommand
+
+from ...contrib.blitline.driver import Driver
+
+
+class Command(BaseCommand):
+    help = 'Submits the pending blitline variations and polls their progress until all are finished.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--concurrency', type='int', default=100,
+            help='Number of blitline requests in flight.'),
+        make_option('--batch-size', type='int', default=500,
+            help='Number of variations submitted or polled per batch.'),
+        make_option('--poll-interval', type='float', default=2.0,
+            help='Seconds between two polls of the running jobs.'),
+        make_option('--submit-only', action='store_true', default=False,
+            help='Only submit the pending jobs, don\'t wait for them.'),
+    )
+
+    def handle(self, *args, **options):
+        driver = Driver(concurrency=options['concurrency'])
+        batch_size = options['batch_size']
+
+        try:
+            submitted = finished = 0
+            while True:
+                pending = driver.get_pending(batch_size)
+                if pending:
+                    count = driver.submit(pending)
+                    submitted += count
+                    if not count:
+                        # blitline is unavailable, don't hammer it
+                        pending = []
+
+                running = [] if options['submit_only'] else driver.get_running(batch_size)
+                if running:
+                    finished += driver.poll(running)
+
+                if not pending and not running:
+                    if options['submit_only'] or not driver.get_pending(1):
+                        break
+
+                self.stdout.write('%s submitted, %s finished\n' % (submitted, finished))
+                if not pending:
+                    sleep(options['poll_interval'])
+        finally:
+            driver.close()
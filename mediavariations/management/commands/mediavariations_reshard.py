@@ -0,0 +1,56 @@
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import settings
+from ...layout import reshard
+from ...models import Variation
+from ...registry import registry
+
+
+class Command(BaseCommand):
+    help = ('Moves the files of the variations into the sharded layout of MEDIAVARIATIONS_SHARD_DEPTH. '
+        'It can be interrupted and run again.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--depth', type='int', default=settings.SHARD_DEPTH,
+            help='Number of directory levels, defaults to MEDIAVARIATIONS_SHARD_DEPTH.'),
+        make_option('--workers', type='int', default=8,
+            help='Number of files moved at the same time.'),
+        make_option('--batch-size', type='int', default=500,
+            help='Number of variations rewritten per transaction.'),
+    )
+
+    def handle(self, *args, **options):
+        if not options['depth']:
+            raise CommandError('Set MEDIAVARIATIONS_SHARD_DEPTH or --depth.')
+
+        # variations with a running job are left alone, their files are not written
+        # yet. older synchronous variations have no processed date
+        specs = Variation.objects.values_list('spec', flat=True).distinct()
+        asynchronous = [spec for spec in specs if self.is_asynchronous(spec)]
+        variations = Variation.objects.exclude(file='').exclude(
+            spec__in=asynchronous, processed__isnull=True).order_by('pk')
+
+        pool = ThreadPool(options['workers'])
+        try:
+            last = rewritten = 0
+            while True:
+                batch = list(variations.filter(pk__gt=last)[:options['batch_size']])
+                if not batch:
+                    break
+
+                rewritten += reshard(batch, pool, options['depth'])
+                last = batch[-1].pk
+                self.stdout.write('%s rewritten, up to variation %s\n' % (rewritten, last))
+        finally:
+            pool.close()
+            pool.join()
+
+    def is_asynchronous(self, spec):
+        try:
+            return registry.get_class(spec).asynchronous
+        except (AttributeError, ImportError, ValueError):
+            # a removed spec has no running jobs
+            return False
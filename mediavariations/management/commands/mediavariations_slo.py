@@ -0,0 +1,31 @@
+from datetime import datetime, timedelta
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from ...reports import PERCENTILES, get_slo_report
+
+
+class Command(BaseCommand):
+    help = 'Prints the time-to-ready percentiles of the variations per spec and per backend.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--hours', type='float', default=24,
+            help='Size of the window in hours, ending now.'),
+    )
+
+    def handle(self, *args, **options):
+        since = datetime.now() - timedelta(hours=options['hours'])
+        report = get_slo_report(since)
+
+        columns = ['count', 'pending', 'failed'] + ['p%s' % p for p in PERCENTILES]
+        line = '%-50s' + ' %10s' * len(columns) + '\n'
+
+        self.stdout.write('Variations processed since %s (seconds)\n' % since.strftime('%Y-%m-%d %H:%M'))
+        for group in ('specs', 'backends'):
+            self.stdout.write('\n' + line % tuple([group] + columns))
+            for row in report[group]:
+                values = [row[column] for column in columns]
+                values = ['-' if value is None else ('%.1f' % value if isinstance(value, float) else value)
+                    for value in values]
+                self.stdout.write(line % tuple([row['name']] + values))
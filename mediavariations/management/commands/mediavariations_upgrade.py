@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import DatabaseError, connection, transaction
+
+from ...models import Variation
+
+
+class Command(BaseCommand):
+    help = ('Adds the missing columns and indexes to the variation table of an existing install. '
+        'Run syncdb first, which creates the new tables. It can be run again.')
+
+    def handle(self, *args, **options):
+        cursor = connection.cursor()
+        qn = connection.ops.quote_name
+        table = Variation._meta.db_table
+
+        existing = [column[0] for column in connection.introspection.get_table_description(cursor, table)]
+
+        with transaction.commit_on_success():
+            for field in Variation._meta.local_fields:
+                if field.column in existing:
+                    continue
+
+                cursor.execute('ALTER TABLE %s ADD COLUMN %s' % (qn(table), self.get_definition(field)))
+                self.stdout.write('Added the column %s\n' % field.column)
+
+            for field in Variation._meta.local_fields:
+                for statement in connection.creation.sql_indexes_for_field(Variation, field, no_style()):
+                    self.create_index(cursor, statement)
+
+    def get_definition(self, field):
+        qn = connection.ops.quote_name
+
+        definition = '%s %s' % (qn(field.column), field.db_type(connection=connection))
+        if field.null:
+            definition += ' NULL'
+        else:
+            # the rows of the previous version get the default of the field
+            definition += " NOT NULL DEFAULT '%s'" % field.get_default().replace("'", "''")
+
+        if field.rel:
+            to = field.rel.to._meta
+            definition += ' REFERENCES %s (%s)' % (qn(to.db_table), qn(to.get_field(field.rel.field_name).column))
+        return definition
+
+    def create_index(self, cursor, statement):
+        sid = transaction.savepoint()
+        try:
+            cursor.execute(statement.rstrip(';'))
+        except DatabaseError:
+            # the index exists already
+            transaction.savepoint_rollback(sid)
+        else:
+            transaction.savepoint_commit(sid)
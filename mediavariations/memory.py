@@ -0,0 +1,87 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from . import settings
+
+
+class MemoryBudget(object):
+    """
+    process-wide budget for the memory, which specs use while processing. a
+    spec reserves its estimate (see specs.Base.get_memory_estimate) and waits
+    until enough of the budget is free. reservations bigger than the whole
+    budget wait until they can run alone.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, nbytes):
+        nbytes = min(nbytes, self.limit)
+
+        with self.condition:
+            while self.used + nbytes > self.limit:
+                self.condition.wait()
+            self.used += nbytes
+
+        return nbytes
+
+    def release(self, nbytes):
+        with self.condition:
+            self.used -= nbytes
+            self.condition.notify_all()
+
+    @contextmanager
+    def reserve(self, nbytes):
+        nbytes = self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+
+class DecodedCache(object):
+    """
+    bounded LRU cache of decoded originals, shared by all specs of a process. the
+    entries are evicted by their size in bytes, e.g. of their pixel buffers.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value, nbytes = self.entries.pop(key)
+            except KeyError:
+                return None
+            self.entries[key] = (value, nbytes)
+            return value
+
+    def set(self, key, value, nbytes):
+        if nbytes > self.limit:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.used -= self.entries.pop(key)[1]
+            self.entries[key] = (value, nbytes)
+            self.used += nbytes
+
+            while self.used > self.limit:
+                evicted, (value, nbytes) = self.entries.popitem(last=False)
+                self.used -= nbytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.used = 0
+
+
+budget = MemoryBudget(settings.MEMORY_BUDGET)
+decoded = DecodedCache(settings.DECODED_CACHE_SIZE)
@@ -1,22 +1,199 @@
-from datetime import datetime
+import hashlib
+from collections import defaultdict
+from datetime import datetime, timedelta
+from time import sleep
 
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
-from django.db import models
+from django.core.cache import cache
+from django.core.files.storage import get_storage_class
+from django.db import IntegrityError, models, transaction
+from django.utils import simplejson
 
-from .utils import get_object
+from . import settings
+from .executor import PRIORITY_DEFAULT, PRIORITY_INTERACTIVE, get_executor, logger
+from .registry import registry
+from .specs import SpecUnavailable
+from .utils import accepts, dump_options, get_options_digest
+
+
+# modern image formats, which specs can save as siblings of a variation, in the
+# order of preference
+FORMATS = (
+    ('avif', 'image/avif'),
+    ('webp', 'image/webp'),
+)
+
+
+class VariationManager(models.Manager):
+    def get_for_object(self, object, spec, options=None):
+        """
+        return the variation of an object and process it, if it is missing.
+        concurrent requests can create the same variation, the oldest one wins.
+        check Variation.wait before using the file.
+        """
+
+        lookup = dict(
+            content_type = ContentType.objects.get_for_model(object),
+            object_id = object.pk,
+            spec = registry.get_path(spec)
+        )
+        dumped = dump_options(options)
+
+        # variations created before the options were canonical have them unsorted
+        legacy = simplejson.dumps(options or {})
+
+        try:
+            variation = self.filter(options__in=[dumped, legacy], **lookup).order_by('pk')[0]
+        except IndexError:
+            variation = self.model(options=dumped, **lookup)
+            variation.save(process=False)
+
+            canonical = variation.get_canonical()
+            if canonical.pk != variation.pk:
+                # lost the race, the canonical variation is processed by its creator
+                self.filter(pk=variation.pk).delete()
+                variation = canonical
+
+        if not variation.file and variation.progress is None and not variation.failure:
+            if not settings.PROCESS_ASYNC:
+                # not processed yet or the backend of the spec was unavailable. fails
+                # fast while the circuit breaker of the backend is open
+                variation.process()
+            elif not variation.is_leased() and cache.add(variation.get_scheduled_cache_key(),
+                    True, settings.LEASE_TIMEOUT):
+                # new, or its job was lost with a worker or found the backend
+                # unavailable. page requests go before bulk jobs
+                variation.schedule(priority=PRIORITY_INTERACTIVE)
+
+        return variation
+
+    def acquire_leases(self, variations):
+        """
+        lease many variations with one UPDATE, see Variation.acquire_lease.
+        returns the variations, which were leased.
+        """
+
+        pks = [variation.pk for variation in variations]
+        now = datetime.now()
+        expires = now + timedelta(seconds=settings.LEASE_TIMEOUT)
+
+        self.filter(
+            models.Q(lease_expires__isnull=True) | models.Q(lease_expires__lte=now),
+            pk__in = pks
+        ).update(lease_expires=expires)
+
+        return self.filter(pk__in=pks, lease_expires=expires)
+
+    def process_grouped(self, variations):
+        """
+        process the variations of the same original one after another, so their
+        specs decode it only once, see memory.DecodedCache
+        """
+
+        for variation in sorted(variations, key=Variation.get_original_key):
+            try:
+                variation.process()
+            except Exception:
+                # the failure is recorded, go on with the others
+                logger.exception('Processing variation %s failed' % variation.pk)
+
+    def update_progress(self, progresses):
+        """
+        persist the progress of many variations, given as dict of pk -> progress.
+        variations with the same progress are written with one UPDATE, which
+        touches only the progress columns.
+        """
+
+        pks_by_progress = defaultdict(list)
+        for pk, progress in progresses.items():
+            cache.set(Variation.get_progress_cache_key(pk), progress)
+            pks_by_progress[progress].append(pk)
+
+        now = datetime.now()
+        for progress, pks in pks_by_progress.items():
+            values = {'progress' : progress, 'modified' : now}
+            if progress >= 1.0:
+                values['processed'] = now
+            self.filter(pk__in=pks).update(**values)
+
+    def poll_progress(self, variations, map_function=map):
+        """
+        ask the specs of many variations for their progress and write the changes
+        with as few statements as possible. the specs are polled with
+        ``map_function``, e.g. the imap_unordered of a thread pool. returns the
+        changed progresses by pk.
+        """
+
+        def poll(variation):
+            try:
+                return variation, variation.get_spec_instance().get_progress()
+            except Exception:
+                logger.exception('Polling the progress of variation %s failed' % variation.pk)
+                return variation, None
+
+        changed = {}
+        for variation, progress in map_function(poll, variations):
+            if progress is not None and variation.set_progress(progress, save=False):
+                changed[variation.pk] = progress
+
+        self.update_progress(changed)
+        return changed
+
+
+class Output(models.Model):
+    """
+    A processed file, which is shared by the variations of byte-identical
+    originals with the same spec and options. It is deleted with the last
+    variation referencing it.
+    """
+
+    checksum = models.CharField(max_length=40)
+    spec = models.CharField(max_length=100)
+    digest = models.CharField(max_length=12)
+
+    name = models.CharField(max_length=100)
+    metadata = models.TextField(blank=True, default='')
+
+    references = models.PositiveIntegerField(default=0)
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = (('checksum', 'spec', 'digest'),)
+
+    def __unicode__(self):
+        return self.name
+
+    def release(self):
+        """
+        drop a reference. returns True if it was the last one, the file can be
+        deleted then.
+        """
+
+        Output.objects.filter(pk=self.pk).update(references=models.F('references') - 1)
+
+        unreferenced = Output.objects.filter(pk=self.pk, references=0)
+        if unreferenced.exists():
+            unreferenced.delete()
+            return True
+        return False
 
 
 class Variation(models.Model):
     """
     The Mediavariation model holds the reference to the variation and also
     to the original FileField.
+
+    Installs of an earlier version upgrade their table with
+    ``manage.py syncdb && manage.py mediavariations_upgrade``.
     """
 
     spec = models.CharField(max_length=100)
     options = models.TextField(default="{}")
 
-    file = models.FileField(blank=True, upload_to="mediavariations/%Y/%m/")
+    file = models.FileField(blank=True, upload_to="mediavariations/%Y/%m/",
+        storage=get_storage_class(settings.STORAGE)() if settings.STORAGE else None)
 
     content_type = models.ForeignKey(ContentType)
     object_id = models.PositiveIntegerField()
@@ -24,11 +201,30 @@ class Variation(models.Model):
     field = models.CharField(max_length=50)
 
     progress = models.FloatField(null=True) # progress with null -> not started yet
-    processed = models.DateTimeField(null=True)
+    processed = models.DateTimeField(null=True, db_index=True)
+
+    # lifecycle for the processing latency reports: queued -> started -> processed
+    queued = models.DateTimeField(null=True, editable=False)
+    started = models.DateTimeField(null=True, editable=False)
+
+    # the error of a spec, which failed for good. these variations are not retried,
+    # unlike the ones, whose backend was unavailable
+    failure = models.TextField(blank=True, editable=False)
+
+    # spec specific state as json, e.g. the blitline job id
+    metadata = models.TextField(default="{}", editable=False)
+
+    # the shared file of byte-identical originals, see reuse_output
+    output = models.ForeignKey(Output, null=True, blank=True, on_delete=models.SET_NULL)
 
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
 
+    # the worker holding the lease is the only one processing this variation
+    lease_expires = models.DateTimeField(null=True, editable=False)
+
+    objects = VariationManager()
+
     def save(self, process=True, *args, **kwargs):
         """
         simply try to guess the mediafile field: fieldname of hte first
@@ -41,6 +237,9 @@ class Variation(models.Model):
                     self.field = field.attname
                     break
 
+        if not self.queued:
+            self.queued = datetime.now()
+
         super(Variation, self).save(*args, **kwargs)
 
         if process:
@@ -48,26 +247,384 @@ class Variation(models.Model):
 
     def delete(self, *args, **kwargs):
         """
-        ensure, that the files are also deleted
+        ensure, that the files are also deleted. shared files are deleted with
+        their last variation.
         """
 
-        self.file.delete(save=False)
+        shared = self.output_id and not self.output.release()
+
+        if self.file and not shared:
+            for name in self.get_metadata().get('formats', {}).values():
+                self.file.storage.delete(name)
+            self.file.delete(save=False)
 
         super(Variation, self).delete(*args, **kwargs)
 
+    def get_format_name(self, format):
+        """
+        the name of the sibling in a modern format (webp, avif), if the spec saved one
+        """
+
+        return self.get_metadata().get('formats', {}).get(format)
+
+    def get_best_format(self, accept):
+        """
+        the preferred sibling format, which the Accept header of a request allows
+        """
+
+        for format, content_type in FORMATS:
+            if self.get_format_name(format) and accepts(accept, content_type):
+                return format
+
+    def get_url(self, accept=None):
+        """
+        the url of the best format for the Accept header of a request
+        """
+
+        format = accept and self.get_best_format(accept)
+        if format:
+            return self.file.storage.url(self.get_format_name(format))
+        return self.file.url
+
+    def get_metadata(self):
+        return simplejson.loads(self.metadata or '{}')
+
+    def set_metadata(self, **values):
+        metadata = self.get_metadata()
+        metadata.update(values)
+        self.metadata = simplejson.dumps(metadata)
+
+    def get_spec_instance(self):
+        if not hasattr(self, 'spec_instance'):
+            self.spec_instance = registry.get_class(self.spec)(variation=self)
+        return self.spec_instance
+
+    def get_original_key(self):
+        return (self.content_type_id, self.object_id, self.field)
+
+    def get_checksum(self):
+        """
+        sha1 of the content of the original, read in chunks. it is cached by the
+        name, size and modification time of the original, so the variations of
+        one original read it only once.
+        """
+
+        cache_key = 'mediavariations:checksum:%s' % hashlib.sha1(
+            repr(self.get_spec_instance().get_original_key())).hexdigest()
+        checksum = cache.get(cache_key)
+        if checksum is not None:
+            return checksum
+
+        # a file object of its own, the spec reads the original too
+        original = getattr(self.content_object, self.field)
+        original = original.storage.open(original.name)
+
+        checksum = hashlib.sha1()
+        try:
+            for chunk in original.chunks():
+                checksum.update(chunk)
+        finally:
+            original.close()
+
+        cache.set(cache_key, checksum.hexdigest())
+        return checksum.hexdigest()
+
+    def get_output_lookup(self, checksum):
+        return dict(
+            checksum = checksum,
+            spec = self.spec,
+            digest = get_options_digest(simplejson.loads(self.options))
+        )
+
+    def reuse_output(self, checksum):
+        """
+        take over the file of a byte-identical original, which was processed with
+        the same spec and options. returns False if there is none.
+        """
+
+        try:
+            output = Output.objects.get(**self.get_output_lookup(checksum))
+        except Output.DoesNotExist:
+            return False
+
+        # the output could lose its last reference in the meantime
+        if not Output.objects.filter(pk=output.pk, references__gt=0).update(
+                references=models.F('references') + 1):
+            return False
+
+        self.output = output
+        self.file = output.name
+        self.metadata = output.metadata
+        return True
+
+    def add_output(self, checksum):
+        """
+        share the processed file with the variations of byte-identical originals.
+        if another worker added one at the same time, this file stays unshared.
+        """
+
+        sid = transaction.savepoint()
+        try:
+            self.output = Output.objects.create(name=self.file.name, metadata=self.metadata,
+                references=1, **self.get_output_lookup(checksum))
+        except IntegrityError:
+            transaction.savepoint_rollback(sid)
+        else:
+            transaction.savepoint_commit(sid)
+
+    def get_siblings(self):
+        """
+        all variations with the same identity as this one. concurrent requests
+        can create more than one.
+        """
+
+        return Variation.objects.filter(
+            content_type = self.content_type_id,
+            object_id = self.object_id,
+            field = self.field,
+            spec = self.spec,
+            options = self.options
+        )
+
+    def get_canonical(self):
+        """
+        the oldest of the siblings is the one which gets processed
+        """
+
+        return self.get_siblings().order_by('pk')[0]
+
+    def acquire_lease(self):
+        """
+        single-flight: only the canonical variation can be leased and the lease is
+        taken with an atomic UPDATE, so exactly one worker gets it. the lease
+        expires after MEDIAVARIATIONS_LEASE_TIMEOUT, in case its worker dies.
+        """
+
+        if self.get_canonical().pk != self.pk:
+            return False
+
+        now = datetime.now()
+        expires = now + timedelta(seconds=settings.LEASE_TIMEOUT)
+
+        acquired = Variation.objects.filter(
+            models.Q(lease_expires__isnull=True) | models.Q(lease_expires__lte=now),
+            pk = self.pk
+        ).update(lease_expires=expires)
+
+        if acquired:
+            self.lease_expires = expires
+
+        return bool(acquired)
+
+    def is_leased(self):
+        return bool(self.lease_expires and self.lease_expires > datetime.now())
+
+    def release_lease(self):
+        Variation.objects.filter(pk=self.pk).update(lease_expires=None)
+        self.lease_expires = None
+
+    def get_pending_group(self):
+        """
+        this and the other unprocessed variations of the same original, whose specs
+        have the same backend. they are processed together, see process_grouped
+        """
+
+        backend = registry.get_class(self.spec).get_backend()
+        pending = Variation.objects.filter(content_type=self.content_type_id, object_id=self.object_id,
+            field=self.field, file='', progress__isnull=True, failure='')
+        return [variation for variation in pending if registry.get_class(variation.spec).get_backend() == backend]
+
+    def is_ready(self):
+        """
+        whether the variation file exists. asynchronous specs set the file, when
+        they submit the job, it is ready once they are processed
+        """
+
+        if not self.file:
+            return False
+        return self.processed is not None or not registry.get_class(self.spec).asynchronous
+
+    def wait(self, timeout=None):
+        """
+        wait until the worker holding the lease stored the variation file. returns
+        False if it is still not ready after ``timeout`` seconds.
+        """
+
+        if timeout is None:
+            timeout = settings.LEASE_WAIT
+
+        waited = 0.0
+        while not self.is_ready() and waited < timeout:
+            sleep(0.1)
+            waited += 0.1
+            self.file, self.processed = Variation.objects.filter(pk=self.pk).values_list('file', 'processed')[0]
+
+        return self.is_ready()
+
     def process(self):
-        spec_class = get_object(self.spec)
-        self.spec_instance = spec_class(variation=self)
-        self.file = self.spec_instance.process()
+        """
+        process the variation, unless another worker is already doing it. returns
+        True if the processing was done by this call. if the backend of the spec
+        is unavailable, the variation stays unprocessed and can be retried.
+
+        with MEDIAVARIATIONS_DEDUPLICATE, the output of a byte-identical original
+        is reused instead.
+        """
 
-        self.progress = 0.0 # this indicates, that processing is started
-        self.save(process=False)
+        if not self.acquire_lease():
+            return False
+
+        self.started = datetime.now()
+
+        try:
+            try:
+                spec = self.get_spec_instance()
+                checksum = settings.DEDUPLICATE and spec.deduplicate and self.get_checksum()
+                if not (checksum and self.reuse_output(checksum)):
+                    self.file = spec.run()
+                    if checksum:
+                        self.add_output(checksum)
+            except SpecUnavailable:
+                Variation.objects.filter(pk=self.pk).update(started=self.started)
+                return False
+            except Exception, e:
+                self.failure = '%s: %s' % (e.__class__.__name__, e)
+                Variation.objects.filter(pk=self.pk).update(started=self.started, failure=self.failure)
+                raise
+
+            if spec.asynchronous:
+                self.progress = 0.0 # this indicates, that processing is started
+            else:
+                self.progress = 1.0
+                self.processed = datetime.now()
+            self.failure = ''
+            self.lease_expires = None
+            self.save(process=False)
+        finally:
+            if self.lease_expires:
+                self.release_lease()
+
+        return True
+
+    def schedule(self, priority=PRIORITY_DEFAULT):
+        """
+        process the variation in the background executor, within the limits of
+        the backend of its spec
+        """
+
+        spec_class = registry.get_class(self.spec)
+        get_executor().submit(process_variation, self.pk, priority=priority, backend=spec_class.get_backend())
+
+    def get_scheduled_cache_key(self):
+        return 'mediavariations:scheduled:%s' % self.pk
+
+    @classmethod
+    def get_progress_cache_key(cls, pk):
+        return 'mediavariations:progress:%s' % pk
+
+    @classmethod
+    def get_cached_progress(cls, pk):
+        """
+        the latest known progress of a variation, including the polls, which were
+        not worth a database write
+        """
+
+        progress = cache.get(cls.get_progress_cache_key(pk))
+        if progress is None:
+            progress = cls.objects.filter(pk=pk).values_list('progress', flat=True)[0]
+        return progress
+
+    def set_progress(self, progress, save=True):
+        """
+        the progress is always cached, but only written to the database when the
+        processing starts or finishes or when it changed by at least
+        MEDIAVARIATIONS_PROGRESS_DELTA. returns True if a write is needed.
+        """
+
+        cache.set(self.get_progress_cache_key(self.pk), progress)
+
+        if self.progress is None or progress >= 1.0:
+            changed = progress != self.progress
+        else:
+            changed = abs(progress - self.progress) >= settings.PROGRESS_DELTA
+
+        if changed:
+            self.progress = progress
+            if progress >= 1.0:
+                self.processed = datetime.now()
+
+            if save:
+                Variation.objects.update_progress({self.pk : progress})
+
+        return changed
+
+    def get_progress(self):
+        progress = self.get_spec_instance().get_progress()
+        self.set_progress(progress)
+        return progress
+
+
+def process_variation(pk):
+    """
+    background job for Variation.schedule
+    """
+
+    variation = Variation.objects.get(pk=pk)
+    if not variation.file and variation.progress is None:
+        # the other variations of a page are usually created meanwhile, their jobs
+        # find them processed
+        Variation.objects.process_grouped(variation.get_pending_group())
+
+
+class Batch(models.Model):
+    """
+    A spec applied in the background on a set of objects, e.g. by an admin action
+    """
+
+    spec = models.CharField(max_length=100)
+
+    total = models.PositiveIntegerField(default=0)
+    completed = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+
+    processed = models.DateTimeField(null=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('-created',)
+        verbose_name_plural = 'batches'
+
+    def __unicode__(self):
+        return u'%s (%s/%s)' % (self.spec, self.completed + self.failed, self.total)
+
+    def add_result(self, success=True):
+        """
+        count an object as done. concurrent workers update the counters with
+        F() expressions, so no result gets lost.
+        """
+
+        column = 'completed' if success else 'failed'
+        Batch.objects.filter(pk=self.pk).update(**{column : models.F(column) + 1})
+
+        Batch.objects.filter(
+            pk = self.pk,
+            processed__isnull = True,
+            completed__gte = models.F('total') - models.F('failed')
+        ).update(processed=datetime.now())
 
     def get_progress(self):
-        self.progress = self.spec_instance.get_progress()
+        if not self.total:
+            return 1.0
+        return float(self.completed + self.failed) / self.total
 
-        if self.progress >= 1.0:
-            self.processed = datetime.now()
+    def get_throughput(self):
+        """
+        objects per second
+        """
 
-        self.save(process=False)
-        return self.progress
+        elapsed = (self.processed or datetime.now()) - self.created
+        seconds = elapsed.days * 86400 + elapsed.seconds + elapsed.microseconds / 1e6
+        if not seconds:
+            return 0.0
+        return (self.completed + self.failed) / seconds
@@ -0,0 +1,66 @@
+from django.core.exceptions import ImproperlyConfigured
+
+from . import settings
+from .utils import get_object
+
+
+class SpecRegistry(object):
+    """
+    Maps spec shortnames (``MEDIAVARIATIONS_SPECS``) to their dotted paths and
+    caches the resolved spec classes, so the hot path is a dict lookup instead
+    of the import machinery.
+
+    In eager mode (the default) every configured spec is imported when the
+    registry is created, so a typo fails at startup and not at render time.
+    In lazy mode a spec is imported on its first use and cached afterwards.
+    """
+
+    def __init__(self, specs, lazy=False):
+        self.paths = dict(specs)
+        self.classes = {}
+
+        if not lazy:
+            self.load()
+
+    def load(self):
+        """
+        resolve all configured specs. collects every broken spec and reports
+        them together, instead of stopping at the first one.
+        """
+        errors = []
+
+        for shortname, path in self.paths.items():
+            try:
+                self.get_class(path)
+            except (AttributeError, ImportError, ValueError), e:
+                errors.append('%s (%s): %s' % (shortname, path, e))
+
+        if errors:
+            raise ImproperlyConfigured('Could not load MEDIAVARIATIONS_SPECS:\n%s' % '\n'.join(errors))
+
+    def get_path(self, spec):
+        """
+        return the dotted path for a shortname. dotted paths are passed through.
+        """
+        try:
+            return self.paths[spec]
+        except KeyError:
+            if '.' in spec:
+                return spec
+            raise KeyError('Unknown mediavariations spec "%s". Add it to MEDIAVARIATIONS_SPECS.' % spec)
+
+    def get_class(self, spec):
+        """
+        return the spec class for a shortname, a dotted path or a class
+        """
+        if not isinstance(spec, basestring):
+            return spec
+
+        try:
+            return self.classes[spec]
+        except KeyError:
+            spec_class = self.classes[spec] = get_object(self.get_path(spec))
+            return spec_class
+
+
+registry = SpecRegistry(settings.SPECS, lazy=settings.LAZY_SPECS)
@@ -0,0 +1,86 @@
+import math
+from datetime import datetime
+
+from django.db import connection
+
+from .models import Variation
+from .registry import registry
+
+
+PERCENTILES = (50, 95, 99)
+
+# seconds between queued and processed, per database vendor
+DURATION_SQL = {
+    'sqlite' : "(julianday(processed) - julianday(queued)) * 86400",
+    'postgresql' : "EXTRACT(EPOCH FROM (processed - queued))",
+    'mysql' : "TIMESTAMPDIFF(MICROSECOND, queued, processed) / 1000000.0",
+    'oracle' : "(CAST(processed AS DATE) - CAST(queued AS DATE)) * 86400",
+}
+
+
+def get_percentiles(queryset):
+    """
+    count and time-to-ready percentiles in seconds of the processed variations
+    in the queryset. the database sorts the durations, only the percentile rows
+    are fetched.
+    """
+
+    count = queryset.count()
+    row = {'count' : count}
+
+    durations = queryset.extra(
+        select = {'duration' : DURATION_SQL[connection.vendor]},
+        order_by = ['duration']
+    ).values_list('duration', flat=True)
+
+    for percentile in PERCENTILES:
+        if count:
+            index = max(int(math.ceil(percentile / 100.0 * count)) - 1, 0)
+            row['p%s' % percentile] = durations[index]
+        else:
+            row['p%s' % percentile] = None
+
+    return row
+
+
+def get_backend(spec):
+    try:
+        return registry.get_class(spec).get_backend()
+    except (AttributeError, ImportError, ValueError):
+        return 'unknown'
+
+
+def get_slo_report(since, until=None):
+    """
+    time-to-ready percentiles per spec and per backend of the variations,
+    which were processed in the window. also counts the variations, which
+    failed or are still waiting.
+    """
+
+    until = until or datetime.now()
+
+    processed = Variation.objects.filter(processed__gte=since, processed__lt=until, queued__isnull=False)
+    pending = Variation.objects.filter(processed__isnull=True, queued__gte=since, queued__lt=until)
+
+    specs = sorted(set(processed.values_list('spec', flat=True).distinct()) |
+        set(pending.values_list('spec', flat=True).distinct()))
+
+    backends = {}
+    for spec in specs:
+        backends.setdefault(get_backend(spec), []).append(spec)
+
+    def get_row(name, specs):
+        row = get_percentiles(processed.filter(spec__in=specs))
+        row.update({
+            'name' : name,
+            'pending' : pending.filter(spec__in=specs, failure='').count(),
+            'failed' : pending.filter(spec__in=specs).exclude(failure='').count(),
+        })
+        return row
+
+    return {
+        'since' : since,
+        'until' : until,
+        'specs' : [get_row(spec, [spec]) for spec in specs],
+        'backends' : [get_row(backend, backends[backend]) for backend in sorted(backends)],
+    }
@@ -1,10 +1,107 @@
+import os
+
 from django.conf import settings as django_settings
 
 
 # a dictionary with shortnames for specs
 SPECS = getattr(django_settings, 'MEDIAVARIATIONS_SPECS', {})
 
+# import the specs on first use instead of at startup. keeps process startup fast,
+# but a misconfigured spec only fails when it is used
+LAZY_SPECS = getattr(django_settings, 'MEDIAVARIATIONS_LAZY_SPECS', False)
+
 # a list of specs, which will be available as admin action to direct apply to a feincms
 # mediafile. direct apply means, that the targeted mediafile will be changed instead of
 # a mediavariation is created
-FEINCMS_ADMINACTION_APPLY_SPECS = getattr(django_settings, 'MEDIAVARIATIONS_FEINCMS_ADMINACTION_APPLY_SPECS', ())
\ No newline at end of file
+FEINCMS_ADMINACTION_APPLY_SPECS = getattr(django_settings, 'MEDIAVARIATIONS_FEINCMS_ADMINACTION_APPLY_SPECS', ())
+
+# the admin actions split the selected mediafiles into batches of this size, which
+# are processed in the background
+FEINCMS_ADMINACTION_BATCH_SIZE = getattr(django_settings, 'MEDIAVARIATIONS_FEINCMS_ADMINACTION_BATCH_SIZE', 20)
+
+# seconds, after which the lease of a worker processing a variation expires
+LEASE_TIMEOUT = getattr(django_settings, 'MEDIAVARIATIONS_LEASE_TIMEOUT', 300)
+
+# seconds, a request waits for a variation processed by another worker, before it
+# falls back to the original
+LEASE_WAIT = getattr(django_settings, 'MEDIAVARIATIONS_LEASE_WAIT', 0)
+
+# executor for background jobs and its number of worker threads
+EXECUTOR = getattr(django_settings, 'MEDIAVARIATIONS_EXECUTOR', 'mediavariations.executor.Scheduler')
+EXECUTOR_WORKERS = getattr(django_settings, 'MEDIAVARIATIONS_EXECUTOR_WORKERS', 4)
+
+# concurrency and rate limits (jobs per second, with bursts) of the backends, e.g.
+# {'blitline' : {'concurrency' : 20, 'rate' : 10, 'burst' : 20}, 'local' : {'concurrency' : 2}}
+BACKEND_LIMITS = getattr(django_settings, 'MEDIAVARIATIONS_BACKEND_LIMITS', {})
+
+# process missing variations of the template filter in the background. the filter
+# falls back to the original until the variation is ready
+PROCESS_ASYNC = getattr(django_settings, 'MEDIAVARIATIONS_PROCESS_ASYNC', False)
+
+# progress changes smaller than this are only cached and not written to the database
+PROGRESS_DELTA = getattr(django_settings, 'MEDIAVARIATIONS_PROGRESS_DELTA', 0.1)
+
+# blitline api client: keep-alive connection pool, timeouts in seconds, retries of
+# failed requests and the circuit breaker, which opens after the given number of
+# consecutive failures and lets a trial request through after the reset time
+BLITLINE_API_URL = getattr(django_settings, 'MEDIAVARIATIONS_BLITLINE_API_URL', 'http://api.blitline.com')
+BLITLINE_CONNECT_TIMEOUT = getattr(django_settings, 'MEDIAVARIATIONS_BLITLINE_CONNECT_TIMEOUT', 3)
+BLITLINE_READ_TIMEOUT = getattr(django_settings, 'MEDIAVARIATIONS_BLITLINE_READ_TIMEOUT', 10)
+BLITLINE_RETRIES = getattr(django_settings, 'MEDIAVARIATIONS_BLITLINE_RETRIES', 2)
+BLITLINE_POOL_SIZE = getattr(django_settings, 'MEDIAVARIATIONS_BLITLINE_POOL_SIZE', 10)
+BLITLINE_BREAKER_THRESHOLD = getattr(django_settings, 'MEDIAVARIATIONS_BLITLINE_BREAKER_THRESHOLD', 5)
+BLITLINE_BREAKER_RESET = getattr(django_settings, 'MEDIAVARIATIONS_BLITLINE_BREAKER_RESET', 30)
+
+# max-age of the responses of the serving view, the urls of variations don't change
+CACHE_MAX_AGE = getattr(django_settings, 'MEDIAVARIATIONS_CACHE_MAX_AGE', 60 * 60 * 24 * 365)
+
+# max-age of the redirects to the storage urls, which can expire or change. keep it
+# below AWS_QUERYSTRING_EXPIRE with signed s3 urls
+REDIRECT_MAX_AGE = getattr(django_settings, 'MEDIAVARIATIONS_REDIRECT_MAX_AGE', 60 * 5)
+
+# let the web server send variations from local storage: 'X-Sendfile' (apache,
+# lighttpd) or 'X-Accel-Redirect' (nginx, with the internal location in
+# MEDIAVARIATIONS_SENDFILE_URL_PREFIX). other storages are served by a redirect
+SENDFILE_HEADER = getattr(django_settings, 'MEDIAVARIATIONS_SENDFILE_HEADER', None)
+SENDFILE_URL_PREFIX = getattr(django_settings, 'MEDIAVARIATIONS_SENDFILE_URL_PREFIX', '/protected/')
+
+# the template filter renders signed urls of the serving view instead of looking up
+# the variation. no database or storage access at render time
+SIGNED_URLS = getattr(django_settings, 'MEDIAVARIATIONS_SIGNED_URLS', False)
+
+# bytes, which all specs of a process may hold in memory at the same time
+MEMORY_BUDGET = getattr(django_settings, 'MEDIAVARIATIONS_MEMORY_BUDGET', 256 * 1024 * 1024)
+
+# bytes of decoded originals, which a process keeps for the next specs applied on
+# the same original, see VariationManager.process_grouped
+DECODED_CACHE_SIZE = getattr(django_settings, 'MEDIAVARIATIONS_DECODED_CACHE_SIZE', 64 * 1024 * 1024)
+
+# originals and results bigger than this are spooled to disk instead of held in memory
+SPOOL_THRESHOLD = getattr(django_settings, 'MEDIAVARIATIONS_SPOOL_THRESHOLD', 32 * 1024 * 1024)
+
+# variations of byte-identical originals with the same spec and options share one
+# processed file. each original is read once more to compute its checksum, also
+# for specs, whose backend fetches the original itself (blitline)
+DEDUPLICATE = getattr(django_settings, 'MEDIAVARIATIONS_DEDUPLICATE', False)
+
+# storage of the variations, e.g. 'mediavariations.storage.TieredStorage'. defaults
+# to the DEFAULT_FILE_STORAGE
+STORAGE = getattr(django_settings, 'MEDIAVARIATIONS_STORAGE', None)
+
+# the tiered storage saves to the local directory first and replicates to the remote
+# storage in the background. replicated files are evicted from the local directory
+# when it grows beyond the given number of bytes
+TIERED_LOCAL_ROOT = getattr(django_settings, 'MEDIAVARIATIONS_TIERED_LOCAL_ROOT',
+    os.path.join(django_settings.MEDIA_ROOT, 'tiered'))
+TIERED_LOCAL_URL = getattr(django_settings, 'MEDIAVARIATIONS_TIERED_LOCAL_URL', django_settings.MEDIA_URL + 'tiered/')
+TIERED_REMOTE_STORAGE = getattr(django_settings, 'MEDIAVARIATIONS_TIERED_REMOTE_STORAGE', django_settings.DEFAULT_FILE_STORAGE)
+TIERED_LOCAL_MAX_SIZE = getattr(django_settings, 'MEDIAVARIATIONS_TIERED_LOCAL_MAX_SIZE', 1024 * 1024 * 1024)
+
+# seconds, after which a file, which is still not replicated, gets a new replication
+# job. the jobs run in the threads of the process and are lost with it
+TIERED_REPLICATION_RETRY = getattr(django_settings, 'MEDIAVARIATIONS_TIERED_REPLICATION_RETRY', 60 * 10)
+
+# 0 saves the variations in monthly directories, mediavariations/%Y/%m/. a depth of 2
+# shards them into mediavariations/ab/cd/ by a digest of their names. move the
+# existing files with the mediavariations_reshard command
+SHARD_DEPTH = getattr(django_settings, 'MEDIAVARIATIONS_SHARD_DEPTH', 0)
@@ -1,12 +1,40 @@
 import os
+import tempfile
+from contextlib import contextmanager
 
 from django.utils import simplejson
-from django.core.files.storage import get_storage_class
+from django.core.files import File
+
+from . import settings
+from .memory import budget
+from .utils import get_sharded_directory
+
+
+class SpecUnavailable(Exception):
+    """
+    raised by specs, whose backend is temporarily unavailable. the variation
+    stays unprocessed and the original is served instead.
+    """
 
 
 class Base(object):
     defaults = {}
 
+    # backend class for the scheduler limits, see get_backend
+    backend = None
+
+    # asynchronous specs return before the variation is ready, get_progress tells
+    # when it is done. the others are finished when process returns
+    asynchronous = False
+
+    # variations of byte-identical originals share the output of this spec. specs,
+    # whose result is not the file, e.g. metadata of the object, turn it off
+    deduplicate = True
+
+    # memory used while processing, as multiple of the size of the original. 0 for
+    # specs, which don't load the original
+    memory_factor = 1
+
     def __init__(self, **kwargs):
         # write down all init args to object attrs -> s = Spec(a=2); s.a -> 2
         for key, value in kwargs.iteritems():
@@ -22,15 +50,103 @@ class Base(object):
             self.variation_filename = getattr(self, 'variation_filename',
                 self.get_variation_filename())
             self.variation_directory = getattr(self, 'variation_directory',
-                self.variation.file.field.get_directory_name())
+                self.get_variation_directory())
             self.variation_path = getattr(self, 'variation_path',
                 os.path.join(self.variation_directory, self.variation_filename))
-            self.storage = getattr(self, 'starage', get_storage_class()())
+            # MEDIAVARIATIONS_STORAGE for variations, the storage of the field for
+            # the mediafiles changed in place
+            self.storage = getattr(self, 'storage', self.variation.file.storage)
 
     @classmethod
     def get_shortname(self):
         return self.__name__.lower()
 
+    @classmethod
+    def get_backend(cls):
+        """
+        the backend, whose concurrency and rate limits apply to this spec.
+        defaults to the contrib package of the spec, e.g. "blitline" or "pypdf",
+        and to "local" for all other specs.
+        """
+        if cls.backend:
+            return cls.backend
+
+        parts = cls.__module__.split('.')
+        if 'contrib' in parts[:-1]:
+            return parts[parts.index('contrib') + 1]
+        return 'local'
+
+    def get_memory_estimate(self):
+        """
+        the bytes this spec holds in memory while processing, based on the size of
+        the original from the storage metadata. originals bigger than
+        MEDIAVARIATIONS_SPOOL_THRESHOLD are spooled to disk, see open_original.
+        """
+        if not self.memory_factor:
+            return 0
+        return int(min(self.original.size, settings.SPOOL_THRESHOLD) * self.memory_factor)
+
+    def run(self):
+        """
+        process within the memory budget of the process
+        """
+        with budget.reserve(self.get_memory_estimate()):
+            return self.process()
+
+    @contextmanager
+    def open_original(self):
+        """
+        the original as seekable file: in memory or, for originals bigger than
+        MEDIAVARIATIONS_SPOOL_THRESHOLD, spooled to a temporary file on disk
+        """
+        spooled = self.spool()
+        for chunk in self.original.chunks():
+            spooled.write(chunk)
+        self.original.close()
+        spooled.seek(0)
+
+        try:
+            yield spooled
+        finally:
+            spooled.close()
+
+    def get_original_key(self):
+        """
+        identifies the content of the original: its name, size and modification
+        time. used as key of the cache of decoded originals.
+        """
+        try:
+            modified_time = self.original.storage.modified_time(self.original.name)
+        except NotImplementedError:
+            modified_time = None
+        return (self.original.name, self.original.size, modified_time)
+
+    def spool(self):
+        """
+        a temporary file, which is held in memory until it grows bigger than
+        MEDIAVARIATIONS_SPOOL_THRESHOLD
+        """
+        return tempfile.SpooledTemporaryFile(max_size=settings.SPOOL_THRESHOLD)
+
+    def save_spooled(self, path, spooled):
+        """
+        save a spooled file to the storage, without reading it into memory
+        """
+        content = File(spooled)
+        content.size = spooled.tell()
+        return self.storage.save(path, content)
+
+    def get_variation_directory(self):
+        """
+        a monthly directory or, with MEDIAVARIATIONS_SHARD_DEPTH, a sharded one.
+        specs applied directly on a mediafile keep its upload_to.
+        """
+        from .models import Variation
+
+        if settings.SHARD_DEPTH and isinstance(self.variation, Variation):
+            return get_sharded_directory(self.variation_filename, settings.SHARD_DEPTH)
+        return self.variation.file.field.get_directory_name()
+
     def get_variation_filename(self):
         return '%s_%s_%s%s' % (self.basename, self.get_shortname(), self.get_options_hash(), self.ext)
 
@@ -45,6 +161,14 @@ class Base(object):
     def get_options_hash(self):
         return hash(simplejson.dumps(self.get_options()))
 
+    def set_metadata(self, **values):
+        """
+        store values in the metadata of the variation. specs can also be applied
+        directly on a mediafile, which has no metadata.
+        """
+        if hasattr(self.variation, 'set_metadata'):
+            self.variation.set_metadata(**values)
+
     def get_progress(self):
         """
         override this function if you can return a progress
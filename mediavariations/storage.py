@@ -0,0 +1,253 @@
+import os
+import threading
+from time import time
+
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage, Storage, get_storage_class
+
+from . import settings
+from .executor import PRIORITY_BULK, get_executor, logger
+
+
+def stat_many(storage, names):
+    """
+    (size, modified time) of many files, None for the missing ones. storages,
+    which can answer many names in a few requests, implement stat_many
+    themselves, the others are asked per name.
+    """
+
+    if hasattr(storage, 'stat_many'):
+        return storage.stat_many(names)
+
+    stats = {}
+    for name in names:
+        if storage.exists(name):
+            stats[name] = (storage.size(name), storage.modified_time(name))
+        else:
+            stats[name] = None
+    return stats
+
+
+def exists_many(storage, names):
+    """
+    check many names at once, see stat_many
+    """
+
+    if hasattr(storage, 'exists_many'):
+        return storage.exists_many(names)
+    return dict((name, storage.exists(name)) for name in names)
+
+
+def replicate(storage, name):
+    """
+    copy a locally saved file to the remote storage of a TieredStorage
+    """
+
+    try:
+        storage.replicate(name)
+    except Exception:
+        logger.exception('Replicating %s to the remote storage failed' % name)
+        return
+    storage.evict()
+
+
+class TieredStorage(Storage):
+    """
+    saves files to a fast local storage and serves them from there, until they
+    are replicated to the remote storage in the background. replicated files
+    stay on the local disk as a cache. when it grows beyond ``max_size`` bytes,
+    the least recently used of them are evicted.
+
+    replication jobs, which got lost (e.g. with a restart of the process), are
+    submitted again after MEDIAVARIATIONS_TIERED_REPLICATION_RETRY seconds.
+
+    use it for the variations with MEDIAVARIATIONS_STORAGE.
+    """
+
+    # eviction frees the local storage down to this part of max_size, so it
+    # doesn't run again on the next save
+    low_water = 0.9
+
+    def __init__(self, local=None, remote=None, max_size=None):
+        self.local = local or FileSystemStorage(location=settings.TIERED_LOCAL_ROOT,
+            base_url=settings.TIERED_LOCAL_URL)
+        self.remote = remote or get_storage_class(settings.TIERED_REMOTE_STORAGE)()
+        self.max_size = settings.TIERED_LOCAL_MAX_SIZE if max_size is None else max_size
+
+        # bytes in the local storage, counted on the first eviction and then kept
+        # up to date. other processes save too, so it is recounted when evicting
+        self.used = None
+        self.lock = threading.Lock()
+
+    def get_cache_key(self, name, state='replicated'):
+        return 'mediavariations:%s:%s' % (state, name.encode('utf-8').encode('hex'))
+
+    def is_replicated(self, name):
+        replicated = cache.get(self.get_cache_key(name))
+        if replicated is None:
+            replicated = self.remote.exists(name)
+            cache.set(self.get_cache_key(name), replicated)
+        return replicated
+
+    def get_replicated_many(self, names):
+        """
+        is_replicated for many names, the uncached ones are checked at once
+        """
+
+        keys = dict((self.get_cache_key(name), name) for name in names)
+        cached = cache.get_many(keys.keys())
+
+        replicated = dict((keys[key], value) for key, value in cached.items())
+        missing = [name for name in names if name not in replicated]
+        if missing:
+            checked = exists_many(self.remote, missing)
+            cache.set_many(dict((self.get_cache_key(name), value) for name, value in checked.items()))
+            replicated.update(checked)
+        return replicated
+
+    def schedule_replication(self, name):
+        """
+        submit the replication job of a file, unless one was submitted within the
+        retry period
+        """
+
+        if cache.add(self.get_cache_key(name, 'replicating'), True, settings.TIERED_REPLICATION_RETRY):
+            get_executor().submit(replicate, self, name, priority=PRIORITY_BULK, backend='replication')
+
+    def retry_replication(self, name, modified):
+        """
+        submit the job again, if the file should have been replicated by now
+        """
+
+        if time() - modified > settings.TIERED_REPLICATION_RETRY:
+            self.schedule_replication(name)
+
+    def touch(self, name):
+        """
+        mark a local file as recently used. only its access time is changed.
+        returns the modification time
+        """
+
+        path = self.local.path(name)
+        try:
+            modified = os.stat(path).st_mtime
+            os.utime(path, (time(), modified))
+        except OSError:
+            return None
+        return modified
+
+    def replicate(self, name):
+        if self.is_replicated(name):
+            return
+
+        with self.local.open(name) as content:
+            self.remote._save(name, content)
+        cache.set(self.get_cache_key(name), True)
+
+    def scan(self):
+        """
+        the local files as (access time, size, name, modification time)
+        """
+
+        files = []
+        for root, dirs, filenames in os.walk(self.local.location):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                name = os.path.relpath(path, self.local.location).replace(os.sep, '/')
+                files.append((stat.st_atime, stat.st_size, name, stat.st_mtime))
+        return files
+
+    def evict(self):
+        """
+        delete the least recently used, replicated files from the local storage,
+        when it grows beyond max_size. the local storage is only scanned then and
+        once per process, which also resubmits the lost replication jobs.
+        """
+
+        with self.lock:
+            if self.used is not None and self.used <= self.max_size:
+                return
+
+        files = self.scan()
+        total = sum(size for atime, size, name, modified in files)
+        replicated = self.get_replicated_many([name for atime, size, name, modified in files])
+
+        for atime, size, name, modified in files:
+            if not replicated[name]:
+                self.retry_replication(name, modified)
+
+        if total > self.max_size:
+            for atime, size, name, modified in sorted(files):
+                if total <= self.max_size * self.low_water:
+                    break
+
+                if replicated[name]:
+                    self.local.delete(name)
+                    total -= size
+
+        with self.lock:
+            self.used = total
+
+    def _open(self, name, mode='rb'):
+        if self.local.exists(name):
+            self.touch(name)
+            return self.local._open(name, mode)
+        return self.remote._open(name, mode)
+
+    def _save(self, name, content):
+        name = self.local._save(name, content)
+        cache.set(self.get_cache_key(name), False)
+
+        with self.lock:
+            if self.used is not None:
+                self.used += self.local.size(name)
+
+        self.schedule_replication(name)
+        return name
+
+    def delete(self, name):
+        if self.local.exists(name):
+            size = self.local.size(name)
+            self.local.delete(name)
+            with self.lock:
+                if self.used is not None:
+                    self.used -= size
+
+        self.remote.delete(name)
+        cache.delete_many([self.get_cache_key(name), self.get_cache_key(name, 'replicating')])
+
+    def exists(self, name):
+        return self.local.exists(name) or self.remote.exists(name)
+
+    def stat_many(self, names):
+        stats = dict((name, (self.local.size(name), self.local.modified_time(name)))
+            for name in names if self.local.exists(name))
+        stats.update(stat_many(self.remote, [name for name in names if name not in stats]))
+        return stats
+
+    def exists_many(self, names):
+        existing = dict((name, True) for name in names if self.local.exists(name))
+        existing.update(exists_many(self.remote, [name for name in names if name not in existing]))
+        return existing
+
+    def size(self, name):
+        if self.local.exists(name):
+            return self.local.size(name)
+        return self.remote.size(name)
+
+    def modified_time(self, name):
+        if self.local.exists(name):
+            return self.local.modified_time(name)
+        return self.remote.modified_time(name)
+
+    def url(self, name):
+        if self.local.exists(name) and not self.is_replicated(name):
+            modified = self.touch(name)
+            if modified is not None:
+                self.retry_replication(name, modified)
+            return self.local.url(name)
+        return self.remote.url(name)
@@ -1,21 +1,85 @@
 from django import template
-from django.contrib.contenttypes.models import ContentType
-from django.utils import simplejson
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
 
 from .. import settings
-from ..models import Variation
+from ..models import FORMATS, Variation
+from ..views import get_signed_url
 
 register = template.Library()
 
 
+def get_variation(object, spec, options=None):
+    """
+    the processed variation and the original file. the variation is None, if
+    it isn't ready yet.
+    """
+
+    variation = Variation.objects.get_for_object(object, spec, options)
+
+    # another worker is processing the variation. wait briefly, then fall back to
+    # the original
+    if not variation.wait():
+        return None, getattr(object, variation.field)
+
+    return variation, getattr(object, variation.field)
+
+
 @register.filter
 def mediavariation(object, spec, field=None, **kwargs):
-    variation, created = Variation.objects.get_or_create(
-        content_type = ContentType.objects.get_for_model(object),
-        object_id = object.pk,
-        spec = settings.SPECS[spec],
-        options = simplejson.dumps(kwargs)
-    )
+    if settings.SIGNED_URLS:
+        return get_signed_url(object, spec, kwargs)
+
+    variation, original = get_variation(object, spec, kwargs)
+
+    if variation is None:
+        return unicode(original.url)
 
     return unicode(variation.file.url)
 
+
+@register.simple_tag(takes_context=True)
+def mediavariation_url(context, object, spec):
+    """
+    the url of the variation in the best format, which the browser accepts
+    according to the Accept header of the request:
+
+        {% mediavariation_url mediafile "thumbnail" %}
+    """
+
+    if settings.SIGNED_URLS:
+        # the serving view negotiates the format
+        return get_signed_url(object, spec)
+
+    variation, original = get_variation(object, spec)
+
+    if variation is None:
+        return original.url
+
+    request = context.get('request')
+    return variation.get_url(request and request.META.get('HTTP_ACCEPT'))
+
+
+@register.simple_tag
+def mediavariation_picture(object, spec, alt=''):
+    """
+    a <picture> element with a source for every sibling format of the variation,
+    so the browser picks the best one itself:
+
+        {% mediavariation_picture mediafile "thumbnail" alt="An elephant" %}
+    """
+
+    variation, original = get_variation(object, spec)
+
+    if variation is None:
+        return mark_safe(u'<img src="%s" alt="%s">' % (escape(original.url), escape(alt)))
+
+    sources = []
+    for format, content_type in FORMATS:
+        name = variation.get_format_name(format)
+        if name:
+            sources.append(u'<source srcset="%s" type="%s">' % (
+                escape(variation.file.storage.url(name)), content_type))
+
+    return mark_safe(u'<picture>%s<img src="%s" alt="%s"></picture>' % (
+        u''.join(sources), escape(variation.file.url), escape(alt)))
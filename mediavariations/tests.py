@@ -1,16 +1,35 @@
 import os
+import shutil
+import tempfile
+import threading
 
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+from datetime import datetime, timedelta
 from time import sleep
 
+from django.core.cache import cache
 from django.core.files import File
+from django.core.files.base import ContentFile
 from django.core.files.images import get_image_dimensions
 from django.contrib.contenttypes.models import ContentType
-from django.test import TestCase
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import FileSystemStorage
+from django.core.urlresolvers import resolve
+from django.http import Http404
+from django.test import TestCase, TransactionTestCase
+from django.test.client import RequestFactory
 from django.utils import simplejson
+from django.utils.unittest import SkipTest
 
 from feincms.module.medialibrary.models import MediaFile
 
-from mediavariations.models import Variation
+from mediavariations.executor import PRIORITY_BULK, PRIORITY_INTERACTIVE, Scheduler, TokenBucket, get_executor
+from mediavariations.models import Batch, Output, Variation
+from mediavariations.registry import SpecRegistry
+from mediavariations.storage import TieredStorage, exists_many, stat_many
+from mediavariations.utils import dump_options
 
 
 class BlitlineTest(TestCase):
@@ -37,6 +56,25 @@ class BlitlineTest(TestCase):
         self.assertEqual(self.mediafile.type, 'image')
         self.assertEqual(get_image_dimensions(self.mediafile.file), (404, 346))
 
+    def test_serve_unfinished(self):
+        from mediavariations.templatetags.mediavariations import get_variation
+        from mediavariations.views import get_url
+
+        # the job is submitted, but blitline didn't upload the file yet
+        variation = Variation(content_object=self.mediafile, spec='mediavariations.contrib.blitline.specs.Generic',
+            options=dump_options({}), file='mediavariations/2013/01/running.jpeg', progress=0.0)
+        variation.save(process=False)
+
+        response = self.client.get(get_url(self.mediafile, 'blitline'))
+        self.assertTrue(response['Location'].endswith(self.mediafile.file.url))
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertEqual(get_variation(self.mediafile, 'blitline')[0], None)
+
+        Variation.objects.update_progress({variation.pk : 1.0})
+        response = self.client.get(get_url(self.mediafile, 'blitline'))
+        self.assertTrue(response['Location'].endswith('running.jpeg'))
+        self.assertEqual(get_variation(self.mediafile, 'blitline')[0].pk, variation.pk)
+
     def test_blitline(self):
         self.variation = Variation(
             content_object=self.mediafile,
@@ -73,6 +111,251 @@ class BlitlineTest(TestCase):
         self.assertTrue(basename in self.variated_url)
 
 
+class PilTest(TestCase):
+    def setUp(self):
+        from mediavariations.contrib.pil.specs import can_save
+
+        # PIL 1.1.7 and Pillow without libwebp can't save the webp siblings
+        self.webp = can_save('WEBP')
+
+        self.mediafile = MediaFile(file=File(open('testapp/fixtures/elephant_test_image.jpeg')))
+        self.mediafile.save()
+
+    def tearDown(self):
+        for variation in Variation.objects.all():
+            variation.delete()
+
+        self.mediafile.delete()
+
+    def test_thumbnail(self):
+        variation = Variation(
+            content_object = self.mediafile,
+            spec = 'mediavariations.contrib.pil.specs.Thumbnail',
+            options = simplejson.dumps({'size' : [100, 100]})
+        )
+        variation.save()
+
+        self.assertEqual(get_image_dimensions(variation.file), (100, 85))
+        self.assertTrue(variation.get_url().endswith('.jpeg'))
+        self.assertTrue(variation.get_url('image/webp,*/*;q=0.8').endswith('.webp' if self.webp else '.jpeg'))
+        self.assertTrue(variation.get_url('image/webp;q=0,*/*').endswith('.jpeg'))
+
+    def test_target_size(self):
+        variation = Variation(
+            content_object = self.mediafile,
+            spec = 'mediavariations.contrib.pil.specs.Thumbnail',
+            options = simplejson.dumps({'size' : [100, 100], 'target_size' : 2500, 'formats' : []})
+        )
+        variation.save()
+
+        metadata = variation.get_metadata()
+        self.assertTrue(variation.file.size <= 2500)
+        self.assertEqual(metadata['size'], variation.file.size)
+        self.assertTrue(30 <= metadata['quality'] < 85)
+
+    def test_reshard(self):
+        from django.core.management import call_command
+        from mediavariations.utils import get_sharded_directory
+
+        variation = Variation(content_object=self.mediafile, spec='mediavariations.contrib.pil.specs.Thumbnail')
+        variation.save()
+        old = variation.file.name
+
+        # processed before the processed date was set for synchronous specs
+        Variation.objects.filter(pk=variation.pk).update(progress=0.0, processed=None)
+
+        # a blitline job, which is still running
+        running = Variation(content_object=self.mediafile, spec='mediavariations.contrib.blitline.specs.Generic',
+            file='mediavariations/2013/01/running.jpeg', progress=0.0)
+        running.save(process=False)
+
+        call_command('mediavariations_reshard', depth=2, stdout=open(os.devnull, 'w'))
+        self.assertEqual(Variation.objects.get(pk=running.pk).file.name, running.file.name)
+
+        variation = Variation.objects.get(pk=variation.pk)
+        directory = get_sharded_directory(os.path.basename(old), 2)
+        self.assertEqual(variation.file.name, '%s/%s' % (directory, os.path.basename(old)))
+        if self.webp:
+            self.assertTrue(variation.get_format_name('webp').startswith(directory))
+        self.assertTrue(variation.file.storage.exists(variation.file.name))
+        self.assertFalse(variation.file.storage.exists(old))
+
+    def test_process_grouped(self):
+        from mediavariations.contrib.pil.specs import Thumbnail
+        from mediavariations.memory import decoded
+
+        variations = []
+        for size in (50, 100, 150):
+            variation = Variation(content_object=self.mediafile, spec='mediavariations.contrib.pil.specs.Thumbnail',
+                options=simplejson.dumps({'size' : [size, size], 'formats' : []}))
+            variation.save(process=False)
+            variations.append(variation)
+
+        opened = []
+        open_original = Thumbnail.open_original
+        def counting_open_original(spec):
+            opened.append(spec)
+            return open_original(spec)
+
+        decoded.clear()
+        Thumbnail.open_original = counting_open_original
+        try:
+            Variation.objects.process_grouped(variations)
+        finally:
+            Thumbnail.open_original = open_original
+
+        # the original is decoded once for all three thumbnails
+        self.assertEqual(len(opened), 1)
+        self.assertEqual([get_image_dimensions(variation.file)[0] for variation in variations], [50, 100, 150])
+
+    def test_process_variation(self):
+        from mediavariations.models import process_variation
+
+        variations = []
+        for spec in ('pil.specs.Thumbnail', 'pil.specs.Thumbnail', 'blitline.specs.Generic'):
+            variation = Variation(content_object=self.mediafile, spec='mediavariations.contrib.%s' % spec,
+                options=dump_options({'size' : [50 * (len(variations) + 1)] * 2, 'formats' : []}))
+            variation.save(process=False)
+            variations.append(variation)
+
+        # the job of the first thumbnail processes the other one too, but not the
+        # one of another backend
+        process_variation(variations[0].pk)
+        self.assertEqual([bool(Variation.objects.get(pk=variation.pk).file) for variation in variations],
+            [True, True, False])
+
+    def test_legacy_options(self):
+        # created with simplejson.dumps, whose key order isn't canonical
+        options = {'quality' : 80, 'formats' : []}
+        self.assertNotEqual(simplejson.dumps(options), simplejson.dumps(options, sort_keys=True))
+
+        variation = Variation(content_object=self.mediafile, spec='mediavariations.contrib.pil.specs.Thumbnail',
+            options=simplejson.dumps(options))
+        variation.save()
+
+        self.assertEqual(Variation.objects.get_for_object(self.mediafile, 'thumbnail', options).pk, variation.pk)
+        self.assertEqual(Variation.objects.count(), 1)
+
+    def test_process_async(self):
+        from mediavariations import settings
+
+        # its job was lost, e.g. with the restart of a worker
+        variation = Variation(content_object=self.mediafile, spec='mediavariations.contrib.pil.specs.Thumbnail',
+            options=dump_options({'formats' : []}))
+        variation.save(process=False)
+        cache.clear()
+
+        # the workers don't share the connection to the test database
+        scheduled = []
+        schedule, Variation.schedule = Variation.schedule, lambda self, priority: scheduled.append(self.pk)
+        process_async, settings.PROCESS_ASYNC = settings.PROCESS_ASYNC, True
+        try:
+            # not while another worker holds the lease
+            Variation.objects.filter(pk=variation.pk).update(lease_expires=datetime.now() + timedelta(minutes=1))
+            Variation.objects.get_for_object(self.mediafile, 'thumbnail', {'formats' : []})
+            self.assertEqual(scheduled, [])
+
+            # once per lease timeout after it expired
+            Variation.objects.filter(pk=variation.pk).update(lease_expires=datetime.now() - timedelta(minutes=1))
+            Variation.objects.get_for_object(self.mediafile, 'thumbnail', {'formats' : []})
+            Variation.objects.get_for_object(self.mediafile, 'thumbnail', {'formats' : []})
+            self.assertEqual(scheduled, [variation.pk])
+
+            # not after it failed for good
+            cache.clear()
+            Variation.objects.filter(pk=variation.pk).update(failure='IOError: truncated')
+            Variation.objects.get_for_object(self.mediafile, 'thumbnail', {'formats' : []})
+            self.assertEqual(scheduled, [variation.pk])
+        finally:
+            Variation.schedule = schedule
+            settings.PROCESS_ASYNC = process_async
+
+    def test_filter_options(self):
+        from mediavariations.templatetags.mediavariations import mediavariation
+
+        url = mediavariation(self.mediafile, 'thumbnail', size=[50, 50], formats=[])
+
+        variation = Variation.objects.get(options=dump_options({'size' : [50, 50], 'formats' : []}))
+        self.assertEqual(url, variation.file.url)
+        self.assertEqual(get_image_dimensions(variation.file), (50, 42))
+
+    def test_picture(self):
+        from mediavariations.templatetags.mediavariations import mediavariation_picture
+
+        html = mediavariation_picture(self.mediafile, 'thumbnail', alt='elephant')
+
+        # a source for the webp sibling, if there is one
+        self.assertEqual(html.startswith('<picture><source srcset="'), self.webp)
+        self.assertEqual('type="image/webp"' in html, self.webp)
+        self.assertTrue(html.endswith('.jpeg" alt="elephant"></picture>'))
+
+
+    def test_serve(self):
+        from mediavariations import settings
+        from mediavariations.views import get_url, serve
+
+        url = get_url(self.mediafile, 'thumbnail', {'size' : [50, 50]})
+
+        response = self.client.get(url, HTTP_ACCEPT='image/webp,*/*')
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].endswith('.webp' if self.webp else '.jpeg'))
+        if self.webp:
+            self.assertEqual(response['Vary'], 'Accept')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=%s' % settings.REDIRECT_MAX_AGE)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'], HTTP_ACCEPT='image/webp')
+        self.assertEqual(response.status_code, 304)
+
+        # sent files are cached for long
+        header, settings.SENDFILE_HEADER = settings.SENDFILE_HEADER, 'X-Sendfile'
+        try:
+            response = self.client.get(url)
+        finally:
+            settings.SENDFILE_HEADER = header
+        self.assertEqual(response['Cache-Control'], 'public, max-age=%s' % settings.CACHE_MAX_AGE)
+        self.assertEqual(Variation.objects.count(), 1)
+
+        # the options don't match the digest
+        request = RequestFactory().get(url.replace('size', 'height'))
+        self.assertRaises(Http404, serve, request, **resolve(request.path).kwargs)
+
+        # the digest is keyed, it can't be computed from the options alone
+        from mediavariations.utils import get_options_digest
+        forged = url.replace(resolve(url.split('?')[0]).kwargs['digest'], get_options_digest({'size' : [50, 50]}))
+        request = RequestFactory().get(forged)
+        self.assertRaises(Http404, serve, request, **resolve(request.path).kwargs)
+
+
+    def test_signed_url(self):
+        from mediavariations.views import get_signed_url, serve_signed
+
+        # the content types are cached per process
+        ContentType.objects.get_for_model(self.mediafile)
+        with self.assertNumQueries(0):
+            url = get_signed_url(self.mediafile, 'thumbnail', {'size' : [50, 50]})
+        self.assertEqual(url, get_signed_url(self.mediafile, 'thumbnail', {'size' : [50, 50]}))
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].endswith('.jpeg'))
+
+        request = RequestFactory().get(url)
+        self.assertRaises(Http404, serve_signed, request, url.split('/')[-2] + 'x')
+
+
+    def test_slo_report(self):
+        from mediavariations.reports import get_slo_report
+
+        variation = Variation(content_object=self.mediafile, spec='mediavariations.contrib.pil.specs.Thumbnail')
+        variation.save()
+        self.assertTrue(variation.queued <= variation.started <= variation.processed)
+
+        report = get_slo_report(variation.queued - timedelta(hours=1))
+        self.assertEqual([row['name'] for row in report['backends']], ['pil'])
+        self.assertEqual(report['specs'][0]['count'], 1)
+        self.assertTrue(report['specs'][0]['p99'] >= 0)
+
+
 class PdfTest(TestCase):
     def setUp(self):
         self.pdf = MediaFile(file=File(open('testapp/fixtures/rst-cheatsheet.pdf')))
@@ -106,4 +389,596 @@ class PdfTest(TestCase):
 
         self.assertEqual(reader.getNumPages(), 1)
 
+    def test_deduplication(self):
+        from mediavariations import settings
+
+        copy = MediaFile(file=File(open('testapp/fixtures/rst-cheatsheet.pdf')))
+        copy.save()
+
+        deduplicate, settings.DEDUPLICATE = settings.DEDUPLICATE, True
+        try:
+            first = Variation(content_object=self.pdf, spec='mediavariations.contrib.pypdf.specs.PageRange')
+            first.save()
+            second = Variation(content_object=copy, spec='mediavariations.contrib.pypdf.specs.PageRange')
+            second.save()
+
+            # the checksum of an original is computed once
+            other = Variation(content_object=self.pdf, spec='mediavariations.contrib.pypdf.specs.PageRange',
+                options=simplejson.dumps({'start' : 1, 'stop' : 2}))
+            other.save(process=False)
+
+            storage = self.pdf.file.storage
+            storage.open = None # fails, if the original is read again
+            try:
+                self.assertEqual(other.get_checksum(), first.output.checksum)
+            finally:
+                del storage.open
+
+            # the page variations of SplitPages belong to their object
+            Variation.objects.get_for_object(self.pdf, 'splitpages')
+            split = Variation.objects.get_for_object(copy, 'splitpages')
+            page = Variation.objects.get(pk=split.get_metadata()['variations']['0-1'])
+            self.assertEqual(page.object_id, copy.pk)
+        finally:
+            settings.DEDUPLICATE = deduplicate
+
+        self.assertEqual(second.file.name, first.file.name)
+        self.assertEqual(Output.objects.get(pk=first.output_id).references, 2)
+
+        # the shared file is deleted with its last variation
+        first.delete()
+        self.assertTrue(second.file.storage.exists(second.file.name))
+        second.delete()
+        self.assertFalse(second.file.storage.exists(second.file.name))
+        self.assertFalse(Output.objects.filter(pk=second.output_id).exists())
+
+        for variation in Variation.objects.filter(object_id=copy.pk):
+            variation.delete()
+        copy.delete()
+
+    def test_permanent_failure(self):
+        corrupt = MediaFile(file=File(open('testapp/fixtures/elephant_test_image.jpeg')))
+        corrupt.save()
+
+        self.assertRaises(Exception, Variation.objects.get_for_object, corrupt, 'splitpages')
+
+        # the spec is not run again on every request
+        variation = Variation.objects.get_for_object(corrupt, 'splitpages')
+        self.assertTrue(variation.failure)
+        self.assertEqual((variation.file.name, variation.progress), ('', None))
+
+        variation.delete()
+        corrupt.delete()
+
+    def test_split_pages(self):
+        from pyPdf import PdfFileReader
+
+        variation = Variation(content_object=self.pdf, spec='mediavariations.contrib.pypdf.specs.SplitPages')
+        variation.save()
+
+        metadata = variation.get_metadata()
+        self.assertEqual(metadata['pages'], 2)
+        self.assertEqual(metadata['info']['Producer'], 'ReportLab http://www.reportlab.com')
+
+        # the pages are written from the parsed document only
+        self.assertEqual(Variation.objects.filter(started__isnull=False).count(), 1)
+
+        # the pages are regular PageRange variations
+        page = Variation.objects.get_for_object(self.pdf, 'mediavariations.contrib.pypdf.specs.PageRange',
+            {'start' : 1, 'stop' : 2})
+        self.assertEqual(page.pk, metadata['variations']['1-2'])
+        self.assertEqual(PdfFileReader(page.file.file).getNumPages(), 1)
+
+    def test_spooled_page_range(self):
+        from pyPdf import PdfFileReader
+        from mediavariations import settings
+
+        threshold, settings.SPOOL_THRESHOLD = settings.SPOOL_THRESHOLD, 1024
+        try:
+            variation = Variation(
+                content_object = self.pdf,
+                spec = 'mediavariations.contrib.pypdf.specs.PageRange',
+                options = simplejson.dumps({'start' : 0, 'stop' : 2})
+            )
+            variation.save(process=False)
+            self.assertEqual(variation.get_spec_instance().get_memory_estimate(), 2048)
+            variation.process()
+        finally:
+            settings.SPOOL_THRESHOLD = threshold
+
+        self.assertEqual(PdfFileReader(variation.file.file).getNumPages(), 2)
+
+    def test_memory_budget(self):
+        from mediavariations.memory import MemoryBudget
+
+        budget = MemoryBudget(100)
+        budget.acquire(80)
+
+        thread = threading.Thread(target=budget.acquire, args=(50,))
+        thread.start()
+        thread.join(0.1)
+        self.assertTrue(thread.is_alive())
+
+        budget.release(80)
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(budget.used, 50)
+
+        # oversized reservations are clamped and run alone
+        budget.release(50)
+        self.assertEqual(budget.acquire(1000), 100)
+
+    def test_single_flight(self):
+        kwargs = dict(
+            content_object = self.pdf,
+            spec = 'mediavariations.contrib.pypdf.specs.PageRange',
+            options = simplejson.dumps({'start' : 0, 'stop' : 1})
+        )
+        first = Variation(**kwargs)
+        first.save(process=False)
+        second = Variation(**kwargs)
+        second.save(process=False)
+
+        self.assertTrue(first.acquire_lease())
+        self.assertFalse(first.acquire_lease())
+        first.release_lease()
+
+        # only the oldest of concurrently created variations gets processed
+        self.assertFalse(second.process())
+        self.assertTrue(first.process())
+        self.assertTrue(first.file)
+        self.assertEqual(first.lease_expires, None)
+
+    def test_coalesced_progress(self):
+        variation = Variation(content_object=self.pdf, spec='mediavariations.contrib.pypdf.specs.PageRange')
+        variation.save(process=False)
+
+        self.assertTrue(variation.set_progress(0.0))
+        self.assertFalse(variation.set_progress(0.05))
+        self.assertEqual(Variation.objects.get(pk=variation.pk).progress, 0.0)
+        self.assertEqual(Variation.get_cached_progress(variation.pk), 0.05)
+
+        self.assertTrue(variation.set_progress(1.0))
+        variation = Variation.objects.get(pk=variation.pk)
+        self.assertEqual(variation.progress, 1.0)
+        self.assertTrue(variation.processed)
+
+    def test_batch(self):
+        from mediavariations.contrib.feincms.extensions import apply_spec
+
+        from mediavariations import settings
+
+        batch = Batch.objects.create(spec='mediavariations.contrib.pypdf.specs.PageRange', total=1)
+
+        # the mediafile keeps its own directory
+        depth, settings.SHARD_DEPTH = settings.SHARD_DEPTH, 2
+        try:
+            apply_spec(batch.pk, MediaFile, [self.pdf.pk])
+        finally:
+            settings.SHARD_DEPTH = depth
+        self.assertFalse(MediaFile.objects.get(pk=self.pdf.pk).file.name.startswith('mediavariations/'))
+
+        batch = Batch.objects.get(pk=batch.pk)
+        self.assertEqual((batch.completed, batch.failed), (1, 0))
+        self.assertEqual(batch.get_progress(), 1.0)
+        self.assertTrue(batch.processed)
+
+
+class RegistryTest(TestCase):
+    def test_resolve(self):
+        from mediavariations.contrib.blitline.specs import Generic
+
+        registry = SpecRegistry({'blitline' : 'mediavariations.contrib.blitline.specs.Generic'})
+
+        self.assertEqual(registry.get_class('blitline'), Generic)
+        self.assertEqual(registry.get_class('mediavariations.contrib.blitline.specs.Generic'), Generic)
+        self.assertEqual(registry.get_path('blitline'), 'mediavariations.contrib.blitline.specs.Generic')
+        self.assertRaises(KeyError, registry.get_path, 'unknown')
+
+    def test_specs_importing_models(self):
+        import sys
+        import types
+
+        # the registry is built while mediavariations.models is imported
+        path = 'mediavariations.contrib.pypdf.specs.SplitPages'
+        models, specs = sys.modules['mediavariations.models'], sys.modules.pop('mediavariations.contrib.pypdf.specs')
+        sys.modules['mediavariations.models'] = types.ModuleType('mediavariations.models')
+        try:
+            registry = SpecRegistry({'splitpages' : path})
+        finally:
+            sys.modules['mediavariations.models'] = models
+            sys.modules['mediavariations.contrib.pypdf.specs'] = specs
+            sys.modules['mediavariations.contrib.pypdf'].specs = specs
+
+        self.assertEqual(registry.get_class('splitpages').__name__, 'SplitPages')
+
+    def test_eager_validation(self):
+        specs = {'typo' : 'mediavariations.contrib.blitline.specs.Genric'}
+
+        self.assertRaises(ImproperlyConfigured, SpecRegistry, specs)
+
+        # lazy registries only fail on first use
+        registry = SpecRegistry(specs, lazy=True)
+        self.assertRaises(AttributeError, registry.get_class, 'typo')
+
+
+class TieredStorageTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.storage = TieredStorage(
+            local = FileSystemStorage(os.path.join(self.root, 'local'), '/local/'),
+            remote = FileSystemStorage(os.path.join(self.root, 'remote'), '/remote/'),
+            max_size = 12
+        )
+        cache.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_replication(self):
+        first = self.storage.save('first.txt', ContentFile('12345678'))
+        get_executor().join()
+
+        self.assertTrue(self.storage.remote.exists(first))
+        self.assertEqual(self.storage.url(first), '/remote/first.txt')
+
+        # the least recently used, replicated file is evicted
+        path = self.storage.local.path(first)
+        os.utime(path, (0, os.stat(path).st_mtime))
+        second = self.storage.save('second.txt', ContentFile('12345678'))
+        get_executor().join()
+
+        self.assertFalse(self.storage.local.exists(first))
+        self.assertTrue(self.storage.local.exists(second))
+        self.assertEqual(self.storage.open(first).read(), '12345678')
+
+        # the local storage isn't scanned again until the running total grows beyond max_size
+        self.assertEqual(self.storage.used, 8)
+        self.storage.scan = None
+        self.storage.evict()
+
+    def test_lost_replication(self):
+        # a file saved by a process, which died before replicating it
+        name = self.storage.local.save('lost.txt', ContentFile('12345678'))
+        self.assertEqual(self.storage.url(name), '/local/lost.txt')
+        get_executor().join()
+        self.assertFalse(self.storage.remote.exists(name))
+
+        # once it's old enough, url() submits the job again
+        path = self.storage.local.path(name)
+        os.utime(path, (0, 0))
+        self.assertEqual(self.storage.url(name), '/local/lost.txt')
+        get_executor().join()
+        self.assertTrue(self.storage.remote.exists(name))
+        self.assertEqual(self.storage.url(name), '/remote/lost.txt')
+
+    def test_variation(self):
+        # configured with MEDIAVARIATIONS_STORAGE
+        field = Variation._meta.get_field('file')
+        storage, field.storage = field.storage, self.storage
+        self.storage.max_size = 1024 * 1024
+
+        mediafile = MediaFile(file=File(open('testapp/fixtures/elephant_test_image.jpeg')))
+        mediafile.save()
+        try:
+            variation = Variation(content_object=mediafile, spec='mediavariations.contrib.pil.specs.Thumbnail',
+                options=dump_options({'size' : [100, 100], 'formats' : []}))
+            variation.save()
+            self.assertTrue(self.storage.local.exists(variation.file.name))
+
+            get_executor().join()
+            self.assertTrue(self.storage.remote.exists(variation.file.name))
+            self.assertTrue(variation.file.url.startswith('/remote/'))
+
+            variation.delete()
+        finally:
+            field.storage = storage
+            mediafile.delete()
+
+    def test_exists_many(self):
+        name = self.storage.save('first.txt', ContentFile('12345678'))
+        get_executor().join()
+
+        self.assertEqual(exists_many(self.storage.remote, [name, 'missing.txt']), {name : True, 'missing.txt' : False})
+        self.assertEqual(stat_many(self.storage, [name, 'missing.txt'])[name][0], 8)
+        self.assertEqual(stat_many(self.storage, ['missing.txt']), {'missing.txt' : None})
+
+
+class S3StorageTest(TestCase):
+    def setUp(self):
+        try:
+            from testapp.s3 import storage
+        except ImproperlyConfigured:
+            raise SkipTest('boto is not installed')
+        self.module = storage
+
+        # patched, so the cache expires without waiting
+        self.now = 1000.0
+        self.time, storage.time.time = storage.time.time, lambda: self.now
+
+    def tearDown(self):
+        self.module.time.time = self.time
+
+    def get_storage(self, **kwargs):
+        from boto.s3.bucket import Bucket
+
+        storage = self.module.S3BotoStorage(bucket='mediavariations', access_key='key', secret_key='secret',
+            querystring_expire=100, url_cache_size=2, url_cache_reuse=0.5, **kwargs)
+        storage._bucket = Bucket(storage.connection, 'mediavariations')
+        return storage
+
+    def test_url_cache(self):
+        cache = self.module.URLCache(2, 50)
+        cache.set('first', 'url')
+        self.now += 49
+        self.assertEqual(cache.get('first'), 'url')
+
+        # reused for querystring_expire * reuse seconds
+        self.now += 1
+        self.assertEqual(cache.get('first'), None)
+
+        # the least recently used url is dropped
+        cache.set('first', 'first url')
+        cache.set('second', 'second url')
+        cache.get('first')
+        cache.set('third', 'third url')
+        self.assertEqual(cache.get('second'), None)
+        self.assertEqual(cache.get('first'), 'first url')
+        self.assertEqual(cache.get('third'), 'third url')
+
+    def test_url(self):
+        storage = self.get_storage()
+        url = storage.url('first.jpeg')
+        self.assertEqual(storage.url('first.jpeg'), url)
+        self.assertEqual(storage._url_cache.max_age, 50)
+
+        self.now += 50
+        self.assertNotEqual(storage.url('first.jpeg'), url)
+
+        # unsigned urls aren't cached
+        storage = self.get_storage(querystring_auth=False)
+        self.assertEqual(storage._url_cache, None)
+        self.assertFalse('Signature=' in storage.url('first.jpeg'))
+
+        storage = self.get_storage(custom_domain='cdn.example.com')
+        self.assertEqual(storage.url('first.jpeg'), 'https://cdn.example.com/first.jpeg')
+        self.assertEqual(len(storage._url_cache._urls), 0)
+
+
+class LayoutTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.storage = FileSystemStorage(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_move(self):
+        from mediavariations.layout import move
+
+        self.storage.save('old.txt', ContentFile('12345678'))
+        self.assertTrue(move(self.storage, 'old.txt', 'ab/new.txt'))
+        self.assertFalse(self.storage.exists('old.txt'))
+        self.assertTrue(self.storage.exists('ab/new.txt'))
+
+        # the new name is taken meanwhile, the storage would save it under another one
+        self.storage.save('old.txt', ContentFile('12345678'))
+        self.storage.get_available_name = lambda name: name.replace('new', 'new_1')
+        self.assertFalse(move(self.storage, 'old.txt', 'cd/new.txt'))
+        self.assertTrue(self.storage.exists('old.txt'))
+        self.assertFalse(self.storage.exists('cd/new_1.txt'))
+
+
+class UpgradeTest(TransactionTestCase):
+    def test_upgrade(self):
+        from django.core.management import call_command
+        from django.db import connection
+
+        cursor = connection.cursor()
+        cursor.execute('ALTER TABLE mediavariations_variation RENAME TO mediavariations_current')
+        try:
+            # the table of the first version
+            cursor.execute("""CREATE TABLE mediavariations_variation (
+                id integer NOT NULL PRIMARY KEY, spec varchar(100) NOT NULL, options text NOT NULL,
+                file varchar(100) NOT NULL, content_type_id integer NOT NULL, object_id integer unsigned NOT NULL,
+                field varchar(50) NOT NULL, progress real, processed datetime, created datetime NOT NULL,
+                modified datetime NOT NULL)""")
+            cursor.execute("""INSERT INTO mediavariations_variation VALUES (1, 'mediavariations.contrib.pil.specs.Thumbnail',
+                '{}', 'mediavariations/2013/01/elephant.jpeg', %s, 1, 'file', 1.0, NULL, '2013-01-01', '2013-01-01')""",
+                [ContentType.objects.get_for_model(MediaFile).pk])
+
+            call_command('mediavariations_upgrade', stdout=open(os.devnull, 'w'))
+            call_command('mediavariations_upgrade', stdout=open(os.devnull, 'w'))
+
+            variation = Variation.objects.get(pk=1)
+            self.assertEqual((variation.failure, variation.get_metadata(), variation.output, variation.lease_expires),
+                ('', {}, None, None))
+        finally:
+            cursor.execute('DROP TABLE mediavariations_variation')
+            cursor.execute('ALTER TABLE mediavariations_current RENAME TO mediavariations_variation')
+
+
+class SchedulerTest(TestCase):
+    def test_backends(self):
+        from mediavariations.contrib.blitline.specs import Pdf2Jpeg
+        from mediavariations.contrib.pypdf.specs import PageRange
+        from mediavariations.specs import Base
+
+        self.assertEqual(Pdf2Jpeg.get_backend(), 'blitline')
+        self.assertEqual(PageRange.get_backend(), 'pypdf')
+        self.assertEqual(Base.get_backend(), 'local')
+
+    def test_priorities(self):
+        scheduler = Scheduler(workers=1, limits={})
+        gate = threading.Event()
+        done = []
+
+        scheduler.submit(gate.wait)
+        scheduler.submit(done.append, 'bulk', priority=PRIORITY_BULK, backend='pypdf')
+        scheduler.submit(done.append, 'interactive', priority=PRIORITY_INTERACTIVE, backend='blitline')
+        gate.set()
+        scheduler.join()
+
+        self.assertEqual(done, ['interactive', 'bulk'])
+
+    def test_limits(self):
+        bucket = TokenBucket(rate=10, burst=1)
+        self.assertEqual(bucket.get_delay(), 0)
+        bucket.consume()
+        self.assertTrue(0 < bucket.get_delay() <= 0.1)
+
+        scheduler = Scheduler(workers=2, limits={'blitline' : {'concurrency' : 1}})
+        gate = threading.Event()
+        done = []
+
+        scheduler.submit(gate.wait, backend='blitline')
+        scheduler.submit(done.append, 'blitline', backend='blitline')
+        scheduler.submit(done.append, 'pypdf', backend='pypdf')
+        sleep(0.2)
+
+        # the second blitline job waits for the first one, the pypdf job doesn't
+        self.assertEqual(done, ['pypdf'])
+        gate.set()
+        scheduler.join()
+        self.assertEqual(done, ['pypdf', 'blitline'])
+
+
+class StubBlitlineHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        status, delay = self.server.responses.pop(0) if self.server.responses else (200, 0)
+        sleep(delay)
+
+        body = simplejson.dumps({'is_complete' : True})
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+        # like servers, which close idle keep-alive connections without telling
+        self.close_connection = self.server.close_idle
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+class StubBlitlineServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients, which timed out, closed the connection
+        pass
+
+
+class BlitlineClientTest(TestCase):
+    def setUp(self):
+        self.server = StubBlitlineServer(('127.0.0.1', 0), StubBlitlineHandler)
+        self.server.connections = set()
+        self.server.responses = []
+        self.server.close_idle = False
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_client(self, **kwargs):
+        from mediavariations.contrib.blitline.client import Client
+
+        kwargs.setdefault('read_timeout', 0.5)
+        kwargs.setdefault('backoff', 0.01)
+        return Client('http://127.0.0.1:%s' % self.server.server_port, **kwargs)
+
+    def test_keep_alive(self):
+        client = self.get_client()
+
+        for i in range(3):
+            self.assertEqual(client.poll('job'), {'is_complete' : True})
+
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_retries(self):
+        client = self.get_client(retries=2)
+        self.server.responses = [(500, 0), (200, 1)] # an error and a read timeout
+
+        self.assertEqual(client.poll('job'), {'is_complete' : True})
+
+    def test_circuit_breaker(self):
+        from mediavariations.contrib.blitline.client import BlitlineError, CircuitBreaker, CircuitOpen
+
+        client = self.get_client(retries=0, breaker=CircuitBreaker(threshold=2, reset_timeout=60))
+        self.server.responses = [(500, 0), (500, 0)]
+
+        self.assertRaises(BlitlineError, client.poll, 'job')
+        self.assertRaises(BlitlineError, client.poll, 'job')
+
+        # the server is fine again, but the breaker fails fast
+        self.assertRaises(CircuitOpen, client.poll, 'job')
+
+    def test_stale_connection(self):
+        from mediavariations.contrib.blitline.client import CircuitBreaker
+
+        client = self.get_client(retries=0, breaker=CircuitBreaker(threshold=1, reset_timeout=60))
+        self.server.close_idle = True
+
+        # submitting isn't idempotent, but the closed connections never got the jobs
+        for i in range(3):
+            self.assertEqual(client.submit_job({'src' : 'elephant.jpeg'}), {'is_complete' : True})
+
+        self.assertEqual(len(self.server.connections), 3)
+        self.assertEqual(client.breaker.failures, 0)
+
+    def test_driver_poll(self):
+        from mediavariations.contrib.blitline import client
+        from mediavariations.contrib.blitline.driver import Driver
+
+        mediafile = MediaFile(file=File(open('testapp/fixtures/elephant_test_image.jpeg')))
+        mediafile.save()
+
+        variation = Variation(content_object=mediafile, spec='mediavariations.contrib.blitline.specs.Generic',
+            progress=0.0, metadata=simplejson.dumps({'blitline_job_id' : 'job'}))
+        variation.save(process=False)
+
+        client._client = self.get_client()
+        driver = Driver(concurrency=2)
+        try:
+            self.assertEqual(driver.poll(driver.get_running(10)), 1)
+        finally:
+            client._client = None
+            driver.close()
+
+        self.assertTrue(Variation.objects.get(pk=variation.pk).processed)
+        self.assertEqual(list(driver.get_running(10)), [])
+
+        variation.delete()
+        mediafile.delete()
+
+    def test_driver_pending(self):
+        from mediavariations.contrib.blitline.driver import Driver
+
+        mediafile = MediaFile(file=File(open('testapp/fixtures/elephant_test_image.jpeg')))
+        mediafile.save()
+
+        pending = Variation(content_object=mediafile, spec='mediavariations.contrib.blitline.specs.Generic')
+        pending.save(process=False)
+        failed = Variation(content_object=mediafile, spec='mediavariations.contrib.blitline.specs.Pdf2Jpeg',
+            failure='KeyError: results')
+        failed.save(process=False)
+
+        driver = Driver(concurrency=1)
+        try:
+            self.assertEqual(list(driver.get_pending(10)), [pending])
+        finally:
+            driver.close()
 
+        pending.delete()
+        failed.delete()
+        mediafile.delete()
@@ -0,0 +1,8 @@
+from django.conf.urls import patterns, url
+
+
+urlpatterns = patterns('mediavariations.views',
+    url(r'^(?P<content_type_id>\d+)-(?P<object_id>\d+)/(?P<spec>[\w-]+)/(?P<digest>[0-9a-f]+)/$',
+        'serve', name='mediavariations_serve'),
+    url(r'^s/(?P<token>[\w.:-]+)/$', 'serve_signed', name='mediavariations_serve_signed'),
+)
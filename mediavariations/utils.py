@@ -1,3 +1,9 @@
+import hashlib
+import os
+
+from django.utils.crypto import salted_hmac
+
+from django.utils import simplejson
 from django.utils.importlib import import_module
 
 # ------------------------------------------------------------------------
@@ -14,4 +20,66 @@ def get_object(path, fail_silently=False):
         return getattr(import_module(mod), fn)
     except (AttributeError, ImportError):
         if not fail_silently:
-            raise
\ No newline at end of file
+            raise
+
+
+# ------------------------------------------------------------------------
+def accepts(accept, content_type):
+    """
+    check whether an Accept header explicitly accepts the content type, e.g.
+    "image/webp". wildcards are ignored, browsers send "*/*" also if they
+    don't support the modern image formats.
+    """
+    for media_range in (accept or '').split(','):
+        parts = [part.strip() for part in media_range.split(';')]
+        if parts[0] != content_type:
+            continue
+
+        for param in parts[1:]:
+            if param.startswith('q='):
+                try:
+                    return float(param[2:]) > 0
+                except ValueError:
+                    return False
+        return True
+
+    return False
+
+
+# ------------------------------------------------------------------------
+def dump_options(options):
+    """
+    canonical json of the options of a variation, equal options give equal json
+    """
+    return simplejson.dumps(options or {}, sort_keys=True)
+
+
+def get_options_digest(options):
+    """
+    short, stable digest of the options of a variation, used in urls
+    """
+    return hashlib.sha1(dump_options(options)).hexdigest()[:12]
+
+
+def get_options_signature(spec, options):
+    """
+    keyed digest of a spec and its options, so only the urls rendered by the
+    site can create variations
+    """
+    return salted_hmac('mediavariations', '%s:%s' % (spec, dump_options(options))).hexdigest()[:20]
+
+
+# ------------------------------------------------------------------------
+def get_sharded_directory(filename, depth):
+    """
+    the directory of a variation in the sharded layout, e.g. mediavariations/ab/cd
+    for a depth of 2. the shards are taken from the sha1 of the filename without
+    its extension, so the siblings in other formats share the directory.
+    """
+    digest = hashlib.sha1(os.path.splitext(filename)[0].encode('utf-8')).hexdigest()
+    return '/'.join(['mediavariations'] + [digest[i * 2:i * 2 + 2] for i in range(depth)])
+
+
+def get_sharded_name(name, depth):
+    filename = name.rsplit('/', 1)[-1]
+    return '%s/%s' % (get_sharded_directory(filename, depth), filename)
@@ -0,0 +1,162 @@
+import hashlib
+import mimetypes
+import time
+import urllib
+
+from django.contrib.contenttypes.models import ContentType
+from django.core import signing
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.urlresolvers import reverse
+from django.http import Http404, HttpResponse, HttpResponseNotModified, HttpResponseRedirect
+from django.utils import simplejson
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from . import settings
+from .models import Variation
+from .registry import registry
+from .utils import dump_options, get_options_signature
+
+
+def get_url(object, spec, options=None):
+    """
+    the url of the serving view for a variation, which may not exist yet
+    """
+
+    url = reverse('mediavariations_serve', kwargs={
+        'content_type_id' : ContentType.objects.get_for_model(object).pk,
+        'object_id' : object.pk,
+        'spec' : spec,
+        'digest' : get_options_signature(spec, options),
+    })
+
+    if options:
+        url += '?' + urllib.urlencode({'options' : dump_options(options)})
+    return url
+
+
+def get_signed_url(object, spec, options=None):
+    """
+    a deterministic url for a variation, signed with the SECRET_KEY. it is computed
+    without any database or storage access (the content types are cached) and
+    carries everything the serving view needs to process the variation.
+    """
+
+    token = signing.dumps(
+        [ContentType.objects.get_for_model(object).pk, object.pk, spec, options or {}],
+        salt = 'mediavariations',
+        compress = True
+    )
+
+    return reverse('mediavariations_serve_signed', kwargs={'token' : token})
+
+
+def serve(request, content_type_id, object_id, spec, digest):
+    """
+    serve a variation and process it on the first request. the digest signs the
+    spec and the options, arbitrary options are rejected.
+    """
+
+    try:
+        options = simplejson.loads(request.GET.get('options', '{}'))
+    except ValueError:
+        raise Http404
+
+    if not constant_time_compare(get_options_signature(spec, options), digest):
+        raise Http404
+
+    return serve_object(request, content_type_id, object_id, spec, options)
+
+
+def serve_signed(request, token):
+    """
+    serve a variation of a signed url, see get_signed_url
+    """
+
+    try:
+        content_type_id, object_id, spec, options = signing.loads(token, salt='mediavariations')
+    except (signing.BadSignature, ValueError):
+        raise Http404
+
+    return serve_object(request, content_type_id, object_id, spec, options)
+
+
+def serve_object(request, content_type_id, object_id, spec, options):
+    if spec not in registry.paths:
+        raise Http404
+
+    try:
+        content_type = ContentType.objects.get_for_id(content_type_id)
+        object = content_type.get_object_for_this_type(pk=object_id)
+    except (ObjectDoesNotExist, AttributeError):
+        raise Http404
+
+    variation = Variation.objects.get_for_object(object, spec, options)
+
+    if not variation.wait():
+        # processed by another worker or its backend is unavailable. serve the
+        # original, but don't let it be cached
+        response = HttpResponseRedirect(getattr(object, variation.field).url)
+        response['Cache-Control'] = 'no-cache'
+        return response
+
+    return serve_variation(request, variation)
+
+
+def is_local(storage, name):
+    """
+    whether the file is on the local disk. the default storage is a lazy object,
+    so the class of the storage can't be checked
+    """
+
+    try:
+        storage.path(name)
+    except NotImplementedError:
+        return False
+    return True
+
+
+def serve_variation(request, variation):
+    """
+    respond with caching headers and let the web server or the storage send the
+    file. django never streams it.
+    """
+
+    format = variation.get_best_format(request.META.get('HTTP_ACCEPT'))
+    name = variation.get_format_name(format) if format else variation.file.name
+    storage = variation.file.storage
+
+    last_modified = variation.processed or variation.modified
+    timestamp = int(time.mktime(last_modified.timetuple()))
+    etag = quote_etag(hashlib.sha1('%s:%s' % (name.encode('utf-8'), timestamp)).hexdigest())
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+
+    if if_none_match:
+        not_modified = etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match == '*'
+    else:
+        not_modified = if_modified_since is not None and timestamp <= if_modified_since
+
+    # the storage urls of redirects can expire (signed s3 urls) or move (tiered
+    # storage), only the sent files are cached for long
+    sendfile = settings.SENDFILE_HEADER and is_local(storage, name)
+    max_age = settings.CACHE_MAX_AGE if sendfile else settings.REDIRECT_MAX_AGE
+
+    if not_modified:
+        response = HttpResponseNotModified()
+    elif sendfile:
+        response = HttpResponse(content_type=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+        if settings.SENDFILE_HEADER == 'X-Accel-Redirect':
+            response['X-Accel-Redirect'] = settings.SENDFILE_URL_PREFIX + name.encode('utf-8')
+        else:
+            response[settings.SENDFILE_HEADER] = storage.path(name).encode('utf-8')
+    else:
+        response = HttpResponseRedirect(storage.url(name))
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(timestamp)
+    response['Cache-Control'] = 'public, max-age=%s' % max_age
+    if variation.get_metadata().get('formats'):
+        response['Vary'] = 'Accept'
+    return response
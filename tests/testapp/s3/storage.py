@@ -46,10 +46,12 @@ SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 import os
 import re
+import tempfile
 import time
 import mimetypes
 import calendar
-from collections import namedtuple
+import threading
+from collections import defaultdict, namedtuple, OrderedDict
 from datetime import datetime
 from dateutil import tz, parser as dateparser
 
@@ -91,6 +93,9 @@ SECURE_URLS = getattr(settings, 'AWS_S3_SECURE_URLS', True)
 FILE_NAME_CHARSET = getattr(settings, 'AWS_S3_FILE_NAME_CHARSET', 'utf-8')
 FILE_OVERWRITE = getattr(settings, 'AWS_S3_FILE_OVERWRITE', True)
 FILE_BUFFER_SIZE = getattr(settings, 'AWS_S3_FILE_BUFFER_SIZE', 5242880)
+FILE_SPOOL_SIZE = getattr(settings, 'AWS_S3_FILE_SPOOL_SIZE', FILE_BUFFER_SIZE)
+URL_CACHE_SIZE = getattr(settings, 'AWS_S3_URL_CACHE_SIZE', 1000)
+URL_CACHE_REUSE = getattr(settings, 'AWS_S3_URL_CACHE_REUSE', 0.5)
 IS_GZIPPED = getattr(settings, 'AWS_IS_GZIPPED', False)
 PRELOAD_METADATA = getattr(settings, 'AWS_PRELOAD_METADATA', False)
 GZIP_CONTENT_TYPES = getattr(settings, 'GZIP_CONTENT_TYPES', (
@@ -143,6 +148,37 @@ cached_entries = {} # dict where key is bucket name, value is a dict of
                     # for the same bucket (allows use of prefixes, differing
                     # redundancy settings, etc. )
 
+
+class URLCache(object):
+    """
+    A bounded LRU cache for signed urls. Each url is reused for ``max_age``
+    seconds, which must be shorter than its expiry.
+    """
+
+    def __init__(self, size, max_age):
+        self.size = size
+        self.max_age = max_age
+        self._urls = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                url, created = self._urls.pop(key)
+            except KeyError:
+                return None
+            if time.time() - created >= self.max_age:
+                return None
+            self._urls[key] = (url, created)
+            return url
+
+    def set(self, key, url):
+        with self._lock:
+            self._urls.pop(key, None)
+            self._urls[key] = (url, time.time())
+            while len(self._urls) > self.size:
+                self._urls.popitem(last=False)
+
 class S3BotoStorage(Storage):
     """
     Amazon Simple Storage Service using Boto
@@ -164,7 +200,9 @@ class S3BotoStorage(Storage):
             location=LOCATION,
             file_name_charset=FILE_NAME_CHARSET,
             preload_metadata=PRELOAD_METADATA,
-            calling_format=CALLING_FORMAT):
+            calling_format=CALLING_FORMAT,
+            url_cache_size=URL_CACHE_SIZE,
+            url_cache_reuse=URL_CACHE_REUSE):
         self.bucket_acl = bucket_acl
         self.bucket_name = bucket
         self.acl = acl
@@ -188,6 +226,11 @@ class S3BotoStorage(Storage):
             calling_format=calling_format)
         self._entries = None
 
+        # signing urls is expensive, reuse them for a part of their lifetime
+        self._url_cache = None
+        if querystring_auth and url_cache_size:
+            self._url_cache = URLCache(url_cache_size, querystring_expire * url_cache_reuse)
+
     @property
     def bucket(self):
         """
@@ -354,6 +397,38 @@ class S3BotoStorage(Storage):
             return True
         return False
 
+    def stat_many(self, names):
+        """
+        Get (size, modified time) of many files, None for the missing ones.
+        The names are grouped by their directory and each directory is answered
+        by one (paginated) list request instead of a HEAD request per name.
+        """
+        stats = {}
+        by_prefix = defaultdict(dict)
+        for name in names:
+            key_name = self._encode_name(self._normalize_name(self._clean_name(name)))
+            entry = self.entries.get(key_name)
+            if entry:
+                stats[name] = (entry.size, self._parse_modified_time(entry.last_modified))
+            else:
+                prefix = key_name.rsplit('/', 1)[0] + '/' if '/' in key_name else ''
+                by_prefix[prefix][key_name] = name
+
+        for prefix, wanted in by_prefix.items():
+            for key in self.bucket.list(prefix=prefix, delimiter='/'):
+                name = wanted.get(self._encode_name(key.name))
+                if name is not None:
+                    stats[name] = (key.size, self._parse_modified_time(key.last_modified))
+            for name in wanted.values():
+                stats.setdefault(name, None)
+        return stats
+
+    def exists_many(self, names):
+        """
+        Check many names at once, see stat_many.
+        """
+        return dict((name, stat is not None) for name, stat in self.stat_many(names).items())
+
     def listdir(self, name):
         name = self._normalize_name(self._clean_name(name))
         # for the bucket.list and logic below name needs to end in /
@@ -385,7 +460,10 @@ class S3BotoStorage(Storage):
         entry = self._get_key(name)
         if not entry:
             raise IOError("File does not exist.")
-        last_modified_date = dateparser.parse(entry.last_modified)
+        return self._parse_modified_time(entry.last_modified)
+
+    def _parse_modified_time(self, last_modified):
+        last_modified_date = dateparser.parse(last_modified)
         # if the date has no timzone, assume UTC
         if last_modified_date.tzinfo == None:
             last_modified_date = last_modified_date.replace(tzinfo=tz.tzutc())
@@ -397,9 +475,16 @@ class S3BotoStorage(Storage):
         if self.custom_domain:
             return "%s://%s/%s" % ('https' if self.secure_urls else 'http',
                                    self.custom_domain, name)
-        return self.connection.generate_url(self.querystring_expire,
+        if self._url_cache is not None:
+            url = self._url_cache.get(name)
+            if url is not None:
+                return url
+        url = self.connection.generate_url(self.querystring_expire,
             method='GET', bucket=self.bucket.name, key=self._encode_name(name),
             query_auth=self.querystring_auth, force_http=not self.secure_urls)
+        if self._url_cache is not None:
+            self._url_cache.set(name, url)
+        return url
 
     def get_available_name(self, name):
         """ Overwrite existing file with the same name. """
@@ -463,7 +548,8 @@ class S3BotoStorageFile(File):
     @property
     def file(self):
         if self._file is None:
-            self._file = StringIO()
+            # big files are spooled to disk instead of held in memory
+            self._file = tempfile.SpooledTemporaryFile(max_size=FILE_SPOOL_SIZE)
             if 'r' in self._mode:
                 self._is_dirty = False
                 self.real_key.get_contents_to_file(self._file)
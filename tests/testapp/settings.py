@@ -106,6 +106,8 @@ BLITLINE_APPLICATION_ID = os.environ.get('BLITLINE_APPLICATION_ID', None)
 MEDIAVARIATIONS_SPECS =  {
     'blitline' : 'mediavariations.contrib.blitline.specs.Generic',
     'pdf2jpg' : 'mediavariations.contrib.blitline.specs.Pdf2Jpeg',
+    'thumbnail' : 'mediavariations.contrib.pil.specs.Thumbnail',
+    'splitpages' : 'mediavariations.contrib.pypdf.specs.SplitPages',
 }
 
 MEDIAVARIATIONS_FEINCMS_ADMINACTION_APPLY_SPECS = (
@@ -19,6 +19,8 @@ urlpatterns = patterns('',
 
     # Uncomment the next line to enable the admin:
     url(r'^admin/', include(admin.site.urls)),
+
+    url(r'^mediavariations/', include('mediavariations.urls')),
 )
 
 if 'runserver' in sys.argv: